@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import uuid
+from cms.utils import get_cms_setting
+from cms.utils.i18n import get_language_list
+from django.core.cache import cache
+
+
+def _get_path_hash(path):
+    return hashlib.md5(path.encode('utf-8')).hexdigest()
+
+
+def _get_version_key(site_id=None, lang=None, path=None):
+    """
+    Returns the key of the version of a title path or, if no path is given,
+    the key of the global page cache version.
+    """
+    if path is None:
+        return "%s:page:version" % get_cms_setting('CACHE_PREFIX')
+    return "%s:page:%s:%s:%s:version" % (get_cms_setting('CACHE_PREFIX'), site_id, lang, _get_path_hash(path))
+
+
+def get_page_cache_version(site_id, lang, path):
+    """
+    Returns the version of a title path: the global version followed by the
+    version of the path itself.
+    """
+    keys = [_get_version_key(), _get_version_key(site_id, lang, path)]
+    versions = cache.get_many(keys)
+    missing = dict((key, uuid.uuid4().hex) for key in keys if key not in versions)
+    if missing:
+        duration = get_cms_setting('CACHE_DURATIONS')['content']
+        for key, version in missing.items():
+            # another process might have been faster, use its version if so
+            if not cache.add(key, version, duration):
+                version = cache.get(key, version)
+            versions[key] = version
+    return '%s.%s' % tuple(versions[key] for key in keys)
+
+
+def _get_vary_hash(request):
+    values = [request.META.get('HTTP_%s' % header.upper().replace('-', '_'), '')
+              for header in get_cms_setting('PAGE_CACHE_VARY_HEADERS')]
+    return hashlib.md5(u'|'.join(values).encode('utf-8')).hexdigest()
+
+
+def get_page_cache_key(request, site_id, lang, path):
+    return "%s:page:%s:%s:%s:%s:%s" % (
+        get_cms_setting('CACHE_PREFIX'), site_id, lang, _get_path_hash(request.path),
+        _get_vary_hash(request), get_page_cache_version(site_id, lang, path))
+
+
+def get_page_cache(request, site_id, lang, path):
+    """
+    Returns a dictionary with the cached 'content' and 'content_type' of the
+    requested page, served for the title path (the slug passed to the details
+    view), or None.
+    """
+    return cache.get(get_page_cache_key(request, site_id, lang, path))
+
+
+def set_page_cache(request, site_id, lang, path, response):
+    cache.set(get_page_cache_key(request, site_id, lang, path),
+              {'content': response.content, 'content_type': response['Content-Type']},
+              get_cms_setting('CACHE_DURATIONS')['content'])
+
+
+def clear_page_cache_path(site_id, lang, path):
+    """
+    Invalidates the cached responses for a title path in the given language.
+    """
+    cache.set(_get_version_key(site_id, lang, path), uuid.uuid4().hex,
+              get_cms_setting('CACHE_DURATIONS')['content'])
+
+
+def clear_page_cache(page, include_descendants=False):
+    """
+    Invalidates the cached responses for all urls of a page (and its
+    descendants). Urls of languages the page has no title in are invalidated
+    too, since they might be served in a fallback language.
+    """
+    from cms.models import Title
+
+    if include_descendants:
+        titles = Title.objects.filter(page__tree_id=page.tree_id, page__lft__gte=page.lft,
+                                      page__rght__lte=page.rght,
+                                      page__publisher_is_draft=page.publisher_is_draft)
+    else:
+        titles = Title.objects.filter(page=page)
+    titles_by_page = {}
+    for page_id, language, path in titles.values_list('page', 'language', 'path'):
+        titles_by_page.setdefault(page_id, {})[language] = path
+    languages = get_language_list(page.site_id)
+    for titles in titles_by_page.values():
+        for language, path in titles.items():
+            clear_page_cache_path(page.site_id, language, path)
+            for other_language in languages:
+                if other_language not in titles:
+                    clear_page_cache_path(page.site_id, other_language, path)
+
+
+def clear_all_page_cache():
+    """
+    Invalidates all cached responses.
+    """
+    cache.set(_get_version_key(), uuid.uuid4().hex, get_cms_setting('CACHE_DURATIONS')['content'])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import uuid
+from cms.utils import get_cms_setting
+from django.core.cache import cache
+
+
+def _get_version_key(placeholder_id=None):
+    """
+    Returns the key of the version of a placeholder or, if no placeholder id
+    is given, the key of the global placeholder content version.
+    """
+    if placeholder_id is None:
+        return "%s:placeholder:version" % get_cms_setting('CACHE_PREFIX')
+    return "%s:placeholder:%s:version" % (get_cms_setting('CACHE_PREFIX'), placeholder_id)
+
+
+def get_placeholder_cache_version(placeholder_id=None):
+    """
+    Returns the content version of a placeholder: the global version followed
+    by the version of the placeholder itself. If no placeholder id is given,
+    only the global version is returned.
+
+    Versions are random, so an evicted version key can never bring back
+    content that has been invalidated before.
+    """
+    keys = [_get_version_key()]
+    if placeholder_id is not None:
+        keys.append(_get_version_key(placeholder_id))
+    versions = cache.get_many(keys)
+    missing = dict((key, uuid.uuid4().hex) for key in keys if key not in versions)
+    if missing:
+        duration = get_cms_setting('CACHE_DURATIONS')['content']
+        for key, version in missing.items():
+            # another process might have been faster, use its version if so
+            if not cache.add(key, version, duration):
+                version = cache.get(key, version)
+            versions[key] = version
+    return '.'.join(versions[key] for key in keys)
+
+
+def get_placeholder_cache_key(placeholder, lang, site_id, width=None):
+    return "%s:placeholder:%s:%s:%s:%s:%s" % (
+        get_cms_setting('CACHE_PREFIX'), placeholder.pk, lang, site_id, width,
+        get_placeholder_cache_version(placeholder.pk))
+
+
+def get_placeholder_cache(placeholder, lang, site_id, width=None):
+    """
+    Returns a dictionary with the cached 'content' and 'sekizai' changes of
+    the placeholder or None.
+    """
+    return cache.get(get_placeholder_cache_key(placeholder, lang, site_id, width))
+
+
+def set_placeholder_cache(placeholder, lang, site_id, content, sekizai, width=None):
+    cache.set(get_placeholder_cache_key(placeholder, lang, site_id, width),
+              {'content': content, 'sekizai': sekizai},
+              get_cms_setting('CACHE_DURATIONS')['content'])
+
+
+def clear_placeholder_cache(placeholder_id=None):
+    """
+    Invalidates the rendered content of a placeholder. If no placeholder id is
+    given, all rendered placeholders are invalidated.
+    """
+    cache.set(_get_version_key(placeholder_id), uuid.uuid4().hex,
+              get_cms_setting('CACHE_DURATIONS')['content'])
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from cms.utils import get_cms_setting
+from cms.utils.compat.dj import force_unicode
+from django.core.cache import cache
+
+
+def _get_plugin_version(instance):
+    """
+    Returns the version of a plugin instance built from its own
+    changed_date and the ones of its child plugin instances (if they have
+    been loaded), so that editing, adding or removing a child invalidates the
+    cached output of its parent too.
+    """
+    versions = []
+    plugins = [instance]
+    while plugins:
+        plugin = plugins.pop()
+        versions.append('%s:%s' % (plugin.pk, plugin.changed_date.isoformat() if plugin.changed_date else ''))
+        plugins.extend(plugin.child_plugin_instances or [])
+    return ','.join(sorted(versions))
+
+
+def get_plugin_cache_key(instance, lang, vary=None):
+    """
+    Returns the cache key for the rendered output of a plugin instance in the
+    given language. 'vary' is the value returned by the plugin's
+    get_cache_vary method. The position of the instance in its placeholder is
+    part of the key as it is available to the plugin template.
+    """
+    meta = instance._render_meta
+    checksum = hashlib.md5(force_unicode(u'%s|%s|%s|%s' % (
+        _get_plugin_version(instance), meta.index, meta.total, vary)).encode('utf-8')).hexdigest()
+    return "%s:plugin:%s:%s:%s" % (get_cms_setting('CACHE_PREFIX'), instance.pk, lang, checksum)
+
+
+def get_plugin_cache(instance, lang, vary=None):
+    """
+    Returns a dictionary with the cached 'content' and 'sekizai' changes of
+    the plugin instance or None.
+    """
+    return cache.get(get_plugin_cache_key(instance, lang, vary))
+
+
+def set_plugin_cache(instance, lang, content, sekizai, vary=None, timeout=None):
+    if timeout is None:
+        timeout = get_cms_setting('CACHE_DURATIONS')['content']
+    cache.set(get_plugin_cache_key(instance, lang, vary),
+              {'content': content, 'sekizai': sekizai}, timeout)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+
+from cms.models import Page, Title
+from cms.models.pluginmodel import CMSPlugin
+from cms.test_utils.util.context_managers import SettingsOverride
+from cms.utils.compat.dj import force_unicode
+from cms.utils.i18n import force_language, get_public_languages
+
+MANIFEST_NAME = '.cms-export.json'
+
+
+def _hash(values):
+    return hashlib.md5(force_unicode(u'|'.join(force_unicode(value) for value in values)).encode('utf-8')).hexdigest()
+
+
+def get_page_fingerprints(site):
+    """
+    Returns a dictionary mapping (page id, language) of all published pages
+    of a site to a fingerprint of everything the rendered page is built from:
+    the page itself, its title, its plugins and the same for all its
+    ancestors.
+    """
+    pages = dict((page['pk'], page) for page in Page.objects.published(site).filter(
+        publisher_is_draft=False).values('pk', 'parent', 'changed_date', 'template', 'login_required'))
+    titles = Title.objects.filter(page__in=pages.keys()).values_list(
+        'page', 'language', 'title', 'page_title', 'menu_title', 'meta_description', 'slug', 'path',
+        'redirect')
+    plugins = CMSPlugin.objects.filter(placeholder__page__in=pages.keys()).order_by('pk').values_list(
+        'placeholder__page', 'language', 'pk', 'changed_date')
+    own = {}
+    for title in titles:
+        own[title[:2]] = [_hash(title[2:])]
+    for page_id, language, plugin_id, changed_date in plugins:
+        if (page_id, language) in own:
+            own[(page_id, language)].append('%s:%s' % (plugin_id, changed_date))
+    fingerprints = {}
+    for (page_id, language), values in own.items():
+        if pages[page_id]['login_required']:
+            continue
+        parts = []
+        current = page_id
+        while current in pages:
+            page = pages[current]
+            parts.append('%s:%s:%s:%s' % (current, page['changed_date'], page['template'],
+                                          _hash(own.get((current, language), []))))
+            current = page['parent']
+        fingerprints[(page_id, language)] = _hash(parts)
+    return fingerprints
+
+
+def get_title_url(language, path):
+    """
+    Returns the url a title with the given language and path is served at.
+    """
+    with force_language(language):
+        if path:
+            return reverse('pages-details-by-slug', kwargs={'slug': path})
+        return reverse('pages-root')
+
+
+def get_export_path(output_dir, site, url):
+    """
+    Returns the file an url of a site is exported to: urls are directories
+    with an index.html file, so the output can be served by any web server
+    that serves index files.
+    """
+    parts = [part for part in url.split('/') if part]
+    return os.path.join(output_dir, site.domain, *(parts + ['index.html']))
+
+
+def _write_file(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # write to a temporary file first, so the web server never serves a
+    # partially written page
+    temp_path = '%s.tmp' % path
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.rename(temp_path, path)
+
+
+def _remove_file(path, output_dir):
+    if os.path.exists(path):
+        os.remove(path)
+    directory = os.path.dirname(path)
+    while directory != output_dir and os.path.isdir(directory) and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+class ExportCommand(BaseCommand):
+    args = '<output_dir> [site=<site id>] [full] [verbose]'
+    help = (u'render all published pages to <output_dir>/<domain>/<url>/index.html, only pages that '
+            u'changed since the last export are rendered again unless "full" is given')
+
+    def handle(self, *args, **kwargs):
+        if not args:
+            raise CommandError("Error: bad arguments -- Usage: manage.py cms export <output_dir> "
+                               "[site=<site id>] [full] [verbose]")
+        output_dir = os.path.abspath(args[0])
+        verbose = 'verbose' in args
+        full = 'full' in args
+        site_ids = [arg.split("=")[1] for arg in args if arg.startswith("site=")]
+        if site_ids:
+            sites = Site.objects.filter(pk__in=site_ids)
+        else:
+            sites = Site.objects.all()
+
+        manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        manifest = {}
+        if not full and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        rendered = skipped = removed = 0
+        for site in sites:
+            site_manifest = manifest.get(str(site.pk), {})
+            new_manifest = {}
+            fingerprints = get_page_fingerprints(site)
+            languages = get_public_languages(site.pk)
+            titles = Title.objects.filter(page__in=set(page_id for page_id, language in fingerprints),
+                                          language__in=languages).values_list('page', 'language', 'path')
+            urls = {}
+            for page_id, language, path in titles:
+                urls[get_title_url(language, path)] = fingerprints[(page_id, language)]
+            # the pages are rendered as requests to the domain of the site, which
+            # the project might not list in ALLOWED_HOSTS, and are written as a
+            # whole, so they aren't streamed
+            allowed_hosts = list(getattr(settings, 'ALLOWED_HOSTS', [])) + [site.domain.split(':')[0]]
+            with SettingsOverride(SITE_ID=site.pk, ALLOWED_HOSTS=allowed_hosts, CMS_PAGE_STREAMING=False):
+                client = Client(HTTP_HOST=site.domain)
+                for url, fingerprint in sorted(urls.items()):
+                    path = get_export_path(output_dir, site, url)
+                    if site_manifest.get(url) == fingerprint and os.path.exists(path):
+                        new_manifest[url] = fingerprint
+                        skipped += 1
+                        continue
+                    response = client.get(url)
+                    if response.status_code != 200:
+                        # redirects, apphooks requiring a login...
+                        self.stderr.write(u'skipping %s%s, status code %s\n' % (
+                            site.domain, url, response.status_code))
+                        continue
+                    _write_file(path, response.content)
+                    new_manifest[url] = fingerprint
+                    rendered += 1
+                    if verbose:
+                        self.stdout.write(u'rendered %s%s\n' % (site.domain, url))
+            for url in set(site_manifest) - set(new_manifest):
+                _remove_file(get_export_path(output_dir, site, url), output_dir)
+                removed += 1
+                if verbose:
+                    self.stdout.write(u'removed %s%s\n' % (site.domain, url))
+            manifest[str(site.pk)] = new_manifest
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        self.stdout.write(u'%s pages rendered, %s unchanged, %s removed\n' % (rendered, skipped, removed))
@@ -1,24 +1,93 @@
 # -*- coding: utf-8 -*-
-from collections import defaultdict
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
 from cms.apphook_pool import apphook_pool
-from cms.models.permissionmodels import (ACCESS_DESCENDANTS,
-    ACCESS_PAGE_AND_DESCENDANTS, ACCESS_CHILDREN, ACCESS_PAGE_AND_CHILDREN, ACCESS_PAGE)
+from cms.models.permissionmodels import (ACCESS_PAGE_AND_DESCENDANTS,
+    ACCESS_CHILDREN, ACCESS_PAGE_AND_CHILDREN, ACCESS_PAGE)
+from cms.models.pagemodel import Page
 from cms.models.permissionmodels import PagePermission, GlobalPagePermission
 from cms.models.titlemodels import Title
 from cms.utils import get_language_from_request
 from cms.utils.conf import get_cms_setting
 from cms.utils.i18n import get_fallback_languages, hide_untranslated
 from cms.utils.page_resolver import get_page_queryset
-from cms.utils.moderator import get_title_queryset
+from cms.utils.moderator import get_title_queryset, use_draft
 from cms.utils.plugins import current_site
 from menus.base import Menu, NavigationNode, Modifier
 from menus.menu_pool import menu_pool
 
 from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
 from django.db.models.query_utils import Q
 from django.utils.translation import get_language
 
 
+def _get_view_restrictions(user=None, site=None):
+    """
+    Returns the ids of the pages restricted by view permissions and the ids
+    of the restricted pages the user is granted to see, as two sets. Like
+    the permissions, they include the public and the draft version of the
+    pages. The page of an ACCESS_CHILDREN or ACCESS_DESCENDANTS permission
+    is restricted but not granted by it.
+
+    The pages a permission applies to are found by comparing their lft and
+    level with the lft and rght of the page of the permission, so this takes
+    a fixed number of queries: the permissions, the pages of the trees with
+    permissions on pages that have children, and the groups of the user if
+    any permission is given to a group.
+    """
+    permissions = PagePermission.objects.filter(can_view=True)
+    if site:
+        permissions = permissions.filter(page__site=site)
+    permissions = list(permissions.values_list(
+        'user_id', 'group_id', 'grant_on', 'page_id', 'page__publisher_public_id', 'page__tree_id',
+        'page__lft', 'page__rght', 'page__level'))
+    restricted = set()
+    granted = set()
+    if not permissions:
+        return restricted, granted
+
+    group_ids = set()
+    if user is not None and any(permission[1] for permission in permissions):
+        group_ids = set(user.groups.values_list('pk', flat=True))
+
+    # the pages of the trees with permissions on pages with children, sorted
+    # by lft: the descendants of a page are the pages with a lft between the
+    # lft and rght of the page
+    tree_ids = set()
+    for user_id, group_id, grant_on, page_id, public_id, tree_id, lft, rght, level in permissions:
+        if grant_on != ACCESS_PAGE and rght - lft > 1:
+            tree_ids.add(tree_id)
+    trees = {}
+    if tree_ids:
+        pages = Page.objects.filter(tree_id__in=tree_ids).order_by('tree_id', 'lft').values_list(
+            'tree_id', 'lft', 'level', 'pk', 'publisher_public_id')
+        for page in pages:
+            lfts, tree_pages = trees.setdefault(page[0], ([], []))
+            lfts.append(page[1])
+            tree_pages.append(page[2:])
+
+    for user_id, group_id, grant_on, page_id, public_id, tree_id, lft, rght, level in permissions:
+        page_ids = []
+        if grant_on in (ACCESS_PAGE, ACCESS_PAGE_AND_CHILDREN, ACCESS_PAGE_AND_DESCENDANTS):
+            page_ids += [page_id, public_id]
+        if grant_on != ACCESS_PAGE and tree_id in trees:
+            lfts, tree_pages = trees[tree_id]
+            descendants = tree_pages[bisect_right(lfts, lft):bisect_left(lfts, rght)]
+            children_only = grant_on in (ACCESS_CHILDREN, ACCESS_PAGE_AND_CHILDREN)
+            for descendant_level, descendant_id, descendant_public_id in descendants:
+                if not children_only or descendant_level == level + 1:
+                    page_ids += [descendant_id, descendant_public_id]
+        page_ids = [pk for pk in page_ids if pk is not None]
+        restricted.update(page_ids)
+        # the page of a children or descendants permission is restricted too,
+        # without being granted by it
+        restricted.add(page_id)
+        if user is not None and ((user_id and user_id == user.pk) or (group_id and group_id in group_ids)):
+            granted.update(page_ids)
+    return restricted, granted
+
+
 def get_visible_pages(request, pages, site=None):
     """
      This code is basically a many-pages-at-once version of
@@ -32,33 +101,7 @@ def get_visible_pages(request, pages, site=None):
     is_setting_public_staff = public_for == 'staff'
     is_auth_user = request.user.is_authenticated()
     visible_page_ids = []
-    restricted_pages = defaultdict(list)
-    page_permissions = PagePermission.objects.filter(can_view=True).select_related('page', 'group__users')
-
-    for perm in page_permissions:
-
-        # collect the pages that are affected by permissions
-        if site and perm.page.site_id != site.pk:
-            continue
-        if perm is not None and perm not in restricted_pages[perm.page.pk]:
-            # affective restricted pages gathering
-            # using mptt functions 
-            # add the page with the perm itself
-            if perm.grant_on in [ACCESS_PAGE, ACCESS_PAGE_AND_CHILDREN, ACCESS_PAGE_AND_DESCENDANTS]:
-                restricted_pages[perm.page.pk].append(perm)
-                restricted_pages[perm.page.publisher_public_id].append(perm)
-                # add children
-            if perm.grant_on in [ACCESS_CHILDREN, ACCESS_PAGE_AND_CHILDREN]:
-                child_ids = perm.page.get_children().values_list('id', 'publisher_public_id')
-                for id, public_id in child_ids:
-                    restricted_pages[id].append(perm)
-                    restricted_pages[public_id].append(perm)
-            # add descendants
-            elif perm.grant_on in [ACCESS_DESCENDANTS, ACCESS_PAGE_AND_DESCENDANTS]:
-                child_ids = perm.page.get_descendants().values_list('id', 'publisher_public_id')
-                for id, public_id in child_ids:
-                    restricted_pages[id].append(perm)
-                    restricted_pages[public_id].append(perm)
+    restricted_pages, granted_pages = _get_view_restrictions(request.user if is_auth_user else None, site)
 
     # anonymous
     # no restriction applied at all
@@ -98,23 +141,6 @@ def get_visible_pages(request, pages, site=None):
 
     has_global_perm.cache = -1
 
-    def has_permission_membership(page):
-        """
-        PagePermission user group membership tests
-        """
-        user_pk = request.user.pk
-        page_pk = page.pk
-        has_perm = False
-        for perm in restricted_pages[page_pk]:
-            if perm.user_id == user_pk:
-                has_perm = True
-            if not perm.group_id:
-                continue
-            group_user_ids = perm.group.user_set.values_list('pk', flat=True)
-            if user_pk in group_user_ids:
-                has_perm = True
-        return has_perm
-
     for page in pages:
         to_add = False
         # default to false, showing a restricted page is bad
@@ -137,7 +163,7 @@ def get_visible_pages(request, pages, site=None):
                 # authenticated staff user, no restriction and public for staff
                 to_add = True
             # check group and user memberships to restricted pages
-            elif is_restricted and has_permission_membership(page):
+            elif is_restricted and page.pk in granted_pages:
                 to_add = True
             elif has_global_perm():
                 to_add = True
@@ -150,6 +176,29 @@ def get_visible_pages(request, pages, site=None):
     return visible_page_ids
 
 
+def get_visibility_fingerprint(request, site=None):
+    """
+    Returns a value identifying the pages get_visible_pages lets the user of
+    the request see, without loading any page: users with the same
+    fingerprint see the same pages.
+
+    Restricted pages are visible to the users and groups of their view
+    permissions, so the fingerprint contains the view permissions that apply
+    to the user besides the global permissions and staff status.
+    """
+    user = request.user
+    if not user.is_authenticated():
+        return None
+    if site is None:
+        site = current_site(request)
+    user_q = Q(user=user) | Q(group__user=user)
+    global_view_perms = GlobalPagePermission.objects.filter(user_q, can_view=True).filter(
+        Q(sites__in=[site.pk]) | Q(sites__isnull=True)).exists()
+    page_permissions = sorted(set(PagePermission.objects.filter(user_q, can_view=True).values_list('pk', flat=True)))
+    return (user.is_staff, global_view_perms, user.has_perm('cms.view_page'), tuple(page_permissions),
+            use_draft(request))
+
+
 def page_to_node(page, home, cut):
     """
     Transform a CMS page into a navigation node.
@@ -221,7 +270,78 @@ def page_to_node(page, home, cut):
     return ret_node
 
 
+# the columns of the pages and titles CMSMenu builds its nodes from
+_PageRow = namedtuple('_PageRow', ['pk', 'parent_id', 'in_navigation', 'soft_root', 'login_required', 'reverse_id',
+                                   'limit_visibility_in_menu', 'navigation_extenders', 'application_urls'])
+_TitleRow = namedtuple('_TitleRow', ['page_id', 'language', 'title', 'menu_title', 'path', 'slug', 'redirect'])
+
+
+def _page_row_to_node(page, titles, home, cut, languages):
+    """
+    The same as page_to_node for a _PageRow, with titles a dictionary of its
+    _TitleRows by language and languages the current language followed by
+    its fallback languages.
+    """
+    attr = {'soft_root': page.soft_root,
+        'auth_required': page.login_required,
+        'reverse_id': page.reverse_id, }
+
+    parent_id = page.parent_id
+    if home and page.parent_id == home.pk and cut:
+        parent_id = None
+
+    if page.limit_visibility_in_menu == None:
+        attr['visible_for_authenticated'] = True
+        attr['visible_for_anonymous'] = True
+    else:
+        attr['visible_for_authenticated'] = page.limit_visibility_in_menu == 1
+        attr['visible_for_anonymous'] = page.limit_visibility_in_menu == 2
+
+    is_home = page.pk == home.pk
+    if is_home:
+        attr['is_home'] = True
+
+    extenders = []
+    if page.navigation_extenders:
+        extenders.append(page.navigation_extenders)
+    lang = languages[0]
+    # the menus of an apphook are only added if the page is translated
+    if lang in titles and page.application_urls:
+        app = apphook_pool.get_apphook(page.application_urls)
+        for menu in app.menus:
+            extenders.append(menu.__name__)
+    if extenders:
+        attr['navigation_extenders'] = extenders
+
+    # like Page.get_title_obj, use the title in the current language or in the
+    # first fallback language it exists in
+    title = None
+    for language in languages + list(titles):
+        if language in titles:
+            title = titles[language]
+            break
+    attr['redirect_url'] = title.redirect
+
+    if is_home and not page.parent_id:
+        url = reverse('pages-root')
+    else:
+        url = reverse('pages-details-by-slug', kwargs={"slug": title.path or title.slug})
+    return NavigationNode(
+        title.menu_title or title.title,
+        url,
+        page.pk,
+        parent_id,
+        attr=attr,
+        visible=page.in_navigation,
+    )
+
+
 class CMSMenu(Menu):
+    def get_cache_vary(self, request):
+        # the nodes only depend on the pages the user can see, users seeing
+        # the same pages share the cached nodes
+        return get_visibility_fingerprint(request)
+
     def get_nodes(self, request):
         page_queryset = get_page_queryset(request)
         site = Site.objects.get_current()
@@ -234,18 +354,22 @@ class CMSMenu(Menu):
         if hide_untranslated(lang, site.pk):
             filters['title_set__language'] = lang
 
+        # only the columns needed for the nodes are loaded, building the
+        # nodes from Page and Title instances is slow for big sites
         pages = page_queryset.published().filter(**filters).order_by("tree_id", "lft")
-        ids = {}
+        page_rows = [_PageRow(*row) for row in pages.values_list(
+            'pk', 'parent', 'in_navigation', 'soft_root', 'login_required', 'reverse_id',
+            'limit_visibility_in_menu', 'navigation_extenders', 'application_urls')]
         nodes = []
         first = True
         home_cut = False
-        home_children = []
+        home_children = set()
         home = None
         actual_pages = []
 
         # cache view perms
-        visible_pages = get_visible_pages(request, pages, site)
-        for page in pages:
+        visible_pages = set(get_visible_pages(request, page_rows, site))
+        for page in page_rows:
             # Pages are ordered by tree_id, therefore the first page is the root
             # of the page tree (a.k.a "home")
             if page.pk not in visible_pages:
@@ -253,29 +377,29 @@ class CMSMenu(Menu):
                 continue
             if not home:
                 home = page
-            page.home_pk_cache = home.pk
             if first and page.pk != home.pk:
                 home_cut = True
             if (page.parent_id == home.pk or page.parent_id in home_children) and home_cut:
-                home_children.append(page.pk)
+                home_children.add(page.pk)
             if (page.pk == home.pk and home.in_navigation) or page.pk != home.pk:
                 first = False
-            ids[page.id] = page
             actual_pages.append(page)
-            page.title_cache = {}
 
         langs = [lang]
         if not hide_untranslated(lang):
             langs.extend(get_fallback_languages(lang))
 
-        titles = list(get_title_queryset(request).filter(page__in=ids, language__in=langs))
-        for title in titles: # add the title and slugs and some meta data
-            page = ids[title.page_id]
-            page.title_cache[title.language] = title
+        titles = {}
+        title_rows = get_title_queryset(request).filter(page__in=pages.order_by().values('pk'),
+                                                       language__in=langs)
+        for title in title_rows.values_list('page', 'language', 'title', 'menu_title', 'path', 'slug', 'redirect'):
+            title = _TitleRow(*title)
+            titles.setdefault(title.page_id, {})[title.language] = title
 
+        title_languages = [get_language()] + get_fallback_languages(get_language())
         for page in actual_pages:
-            if page.title_cache:
-                nodes.append(page_to_node(page, home, home_cut))
+            if page.pk in titles:
+                nodes.append(_page_row_to_node(page, titles[page.pk], home, home_cut, title_languages))
         return nodes
 
 
@@ -11,14 +11,18 @@ from django.db import models
 from django.db.models.base import model_unpickle
 from django.db.models.query_utils import DeferredAttribute
 from django.utils import timezone, simplejson
-from django.utils.translation import ugettext_lazy as _
+from django.utils.translation import ugettext_lazy as _, get_language
+from cms.cache.plugin import get_plugin_cache, set_plugin_cache
 from cms.exceptions import DontUsePageAttributeWarning
 from cms.models.placeholdermodel import Placeholder
 from cms.plugin_rendering import PluginContext, render_plugin
 from cms.utils.helpers import reversion_register
 from cms.utils.compat.dj import force_unicode, python_2_unicode_compatible
 from cms.utils import get_cms_setting
+from cms.utils.placeholder import restore_sekizai
+from cms.utils.profiler import start_plugin_profile, finish_plugin_profile
 from mptt.models import MPTTModel, MPTTModelBase
+from sekizai.helpers import Watcher
 
 
 class BoundRenderMeta(object):
@@ -175,26 +179,48 @@ class CMSPlugin(with_metaclass(PluginModelBase, MPTTModel)):
     def render_plugin(self, context=None, placeholder=None, admin=False, processors=None):
         instance, plugin = self.get_plugin_instance()
         if instance and not (admin and not plugin.admin_preview):
-            if not isinstance(placeholder, Placeholder):
-                placeholder = instance.placeholder
-            placeholder_slot = placeholder.slot
-            current_app = context.current_app if context else None
-            context = PluginContext(context, instance, placeholder, current_app=current_app)
-            context = plugin.render(context, instance, placeholder_slot)
-            request = context.get('request', None)
-            page = None
-            if request:
-                page = request.current_page
-            context['allowed_child_classes'] = plugin.get_child_classes(placeholder_slot, page)
-            if plugin.render_plugin:
-                template = hasattr(instance, 'render_template') and instance.render_template or plugin.render_template
-                if not template:
-                    raise ValidationError("plugin has no render_template: %s" % plugin.__class__)
-            else:
-                template = None
-            return render_plugin(context, instance, placeholder, template, processors, context.current_app)
+            if not get_cms_setting('PLUGIN_PROFILER'):
+                return self._render_plugin(instance, plugin, context, placeholder, admin, processors)
+            profile = start_plugin_profile(instance)
+            try:
+                return self._render_plugin(instance, plugin, context, placeholder, admin, processors)
+            finally:
+                finish_plugin_profile(profile, plugin, instance, context)
         return ""
 
+    def _render_plugin(self, instance, plugin, context, placeholder, admin, processors):
+        if not isinstance(placeholder, Placeholder):
+            placeholder = instance.placeholder
+        placeholder_slot = placeholder.slot
+        # output rendered for the frontend editor or the admin is never cached
+        use_cache = plugin.cache and context is not None and not processors and not admin
+        if use_cache:
+            language = get_language()
+            vary = plugin.get_cache_vary(context, instance, placeholder)
+            cached = get_plugin_cache(instance, language, vary)
+            if cached is not None:
+                restore_sekizai(context, cached['sekizai'])
+                return mark_safe(cached['content'])
+            watcher = Watcher(context)
+        current_app = context.current_app if context else None
+        context = PluginContext(context, instance, placeholder, current_app=current_app)
+        context = plugin.render(context, instance, placeholder_slot)
+        request = context.get('request', None)
+        page = None
+        if request:
+            page = request.current_page
+        context['allowed_child_classes'] = plugin.get_child_classes(placeholder_slot, page)
+        if plugin.render_plugin:
+            template = hasattr(instance, 'render_template') and instance.render_template or plugin.render_template
+            if not template:
+                raise ValidationError("plugin has no render_template: %s" % plugin.__class__)
+        else:
+            template = None
+        content = render_plugin(context, instance, placeholder, template, processors, context.current_app)
+        if use_cache:
+            set_plugin_cache(instance, language, content, watcher.get_changes(), vary, plugin.cache_timeout)
+        return content
+
     def get_media_path(self, filename):
         pages = self.placeholder.page_set.all()
         if pages.count():
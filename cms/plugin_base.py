@@ -102,6 +102,17 @@ class CMSPluginBase(with_metaclass(CMSPluginBaseMetaclass, admin.ModelAdmin)):
     # Should the plugin be rendered at all, or doesn't it have any output?
     render_plugin = True
 
+    # Should the rendered output be cached? Only enable this for plugins whose
+    # output depends on nothing but the instance (and its children), the
+    # language and whatever get_cache_vary returns.
+    cache = False
+    # Cache timeout in seconds, defaults to CMS_CACHE_DURATIONS['content']
+    cache_timeout = None
+
+    # Can the plugin be rendered in another thread than the request, see
+    # CMS_PLUGIN_RENDER_THREADS?
+    thread_safe = False
+
     model = CMSPlugin
     text_enabled = False
     page_only = False
@@ -141,6 +152,16 @@ class CMSPluginBase(with_metaclass(CMSPluginBaseMetaclass, admin.ModelAdmin)):
         context['placeholder'] = placeholder
         return context
 
+    def get_cache_vary(self, context, instance, placeholder):
+        """
+        Overwrite this if cache = True and the output of the plugin depends on
+        more than the instance and the language, eg on the current user.
+
+        Return a value uniquely identifying that dependency, it becomes part of
+        the cache key.
+        """
+        return None
+
     @property
     def parent(self):
         return self.cms_plugin_instance.parent
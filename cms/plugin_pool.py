@@ -3,6 +3,7 @@ from cms.exceptions import PluginAlreadyRegistered, PluginNotRegistered
 from cms.plugin_base import CMSPluginBase
 from cms.utils.django_load import load
 from cms.utils.helpers import reversion_register
+from cms.utils import get_cms_setting
 from cms.utils.placeholder import get_placeholder_conf
 from cms.utils.compat.dj import force_unicode
 from django.conf import settings
@@ -16,6 +17,23 @@ class PluginPool(object):
     def __init__(self):
         self.plugins = {}
         self.discovered = False
+        self._cache = {}
+        self._cached_placeholder_conf = None
+
+    def get_cache(self):
+        """
+        Returns a dictionary to memoize values computed from the registered
+        plugins and CMS_PLACEHOLDER_CONF in. It is emptied whenever a plugin
+        is registered or unregistered or CMS_PLACEHOLDER_CONF changes.
+        """
+        placeholder_conf = get_cms_setting('PLACEHOLDER_CONF')
+        if placeholder_conf is not self._cached_placeholder_conf:
+            self._cache = {}
+            self._cached_placeholder_conf = placeholder_conf
+        return self._cache
+
+    def clear_cache(self):
+        self._cache = {}
 
     def discover_plugins(self):
         if self.discovered:
@@ -42,6 +60,7 @@ class PluginPool(object):
             )
         plugin.value = plugin_name
         self.plugins[plugin_name] = plugin
+        self.clear_cache()
 
         if 'reversion' in settings.INSTALLED_APPS:
             try:
@@ -65,16 +84,28 @@ class PluginPool(object):
                 'The plugin %r is not registered' % plugin
             )
         del self.plugins[plugin_name]
+        self.clear_cache()
 
     def get_all_plugins(self, placeholder=None, page=None, setting_key="plugins", include_page_only=True):
         self.discover_plugins()
-        plugins = list(self.plugins.values())
-        plugins.sort(key=lambda obj: force_unicode(obj.name))
-        final_plugins = []
         if page:
             template = page.get_template()
         else:
             template = None
+        cache = self.get_cache()
+        # placeholders might be passed as slot names or Placeholder instances
+        if placeholder:
+            placeholder = force_unicode(placeholder)
+        # the plugins are sorted by their translated names and modules
+        cache_key = ('get_all_plugins', placeholder, template, setting_key, include_page_only, get_language())
+        if cache_key not in cache:
+            cache[cache_key] = tuple(self._get_all_plugins(placeholder, template, setting_key, include_page_only))
+        return list(cache[cache_key])
+
+    def _get_all_plugins(self, placeholder, template, setting_key, include_page_only):
+        plugins = list(self.plugins.values())
+        plugins.sort(key=lambda obj: force_unicode(obj.name))
+        final_plugins = []
         allowed_plugins = get_placeholder_conf(
             setting_key,
             placeholder,
@@ -1,18 +1,31 @@
 # -*- coding: utf-8 -*-
+from __future__ import with_statement
+from copy import copy
+from functools import partial
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+from cms.cache.placeholder import get_placeholder_cache, set_placeholder_cache
 from cms.models.placeholdermodel import Placeholder
 from cms.plugin_processors import (plugin_meta_context_processor, mark_safe_plugin_processor)
 from cms.utils import get_language_from_request
 from cms.utils.compat.type_checks import string_types
 from cms.utils.conf import get_cms_setting
 from cms.utils.django_load import iterload_objects
-from cms.utils.placeholder import get_placeholder_conf
-from cms.utils.i18n import get_fallback_languages, get_default_language
+from cms.utils.placeholder import get_placeholder_conf, restore_sekizai
+from cms.utils.profiler import get_current_profile
+from cms.utils.i18n import get_fallback_languages, get_default_language, force_language
+from django.conf import settings
+from django.db import connections, transaction
 from django.template import Template, Context
+from django.template.context import RenderContext
 from django.template.defaultfilters import title
 from django.template.loader import render_to_string
+from django.test.signals import setting_changed
 from django.utils.safestring import mark_safe
-from django.utils.translation import ugettext_lazy as _
+from django.utils.translation import ugettext_lazy as _, get_language
 from cms.utils.placeholder import get_toolbar_plugin_struct
+from sekizai.helpers import Watcher, get_varname
 
 # these are always called before all other plugin context processors
 DEFAULT_PLUGIN_CONTEXT_PROCESSORS = (
@@ -24,6 +37,30 @@ DEFAULT_PLUGIN_PROCESSORS = (
     mark_safe_plugin_processor,
 )
 
+# setting name -> (setting value, processors), see get_standard_processors
+_standard_processors = {}
+
+
+def get_standard_processors(settings_attr):
+    """
+    Returns the processors of the CMS setting settings_attr (eg
+    'PLUGIN_PROCESSORS') as a tuple of callables. They are only imported once
+    and imported again if the setting changes.
+    """
+    setting = get_cms_setting(settings_attr)
+    cached = _standard_processors.get(settings_attr, None)
+    if cached is None or cached[0] is not setting:
+        cached = (setting, tuple(iterload_objects(setting)))
+        _standard_processors[settings_attr] = cached
+    return cached[1]
+
+
+def clear_standard_processors(setting, **kwargs):
+    if setting in ('CMS_PLUGIN_PROCESSORS', 'CMS_PLUGIN_CONTEXT_PROCESSORS'):
+        _standard_processors.clear()
+
+setting_changed.connect(clear_standard_processors, dispatch_uid='cms.plugin_rendering.clear_standard_processors')
+
 
 class PluginContext(Context):
     """
@@ -39,7 +76,7 @@ class PluginContext(Context):
             processors = []
         for processor in DEFAULT_PLUGIN_CONTEXT_PROCESSORS:
             self.update(processor(instance, placeholder, self))
-        for processor in iterload_objects(get_cms_setting('PLUGIN_CONTEXT_PROCESSORS')):
+        for processor in get_standard_processors('PLUGIN_CONTEXT_PROCESSORS'):
             self.update(processor(instance, placeholder, self))
         for processor in processors:
             self.update(processor(instance, placeholder, self))
@@ -52,13 +89,17 @@ def render_plugin(context, instance, placeholder, template, processors=None, cur
     """
     if not processors:
         processors = []
+    profile = get_current_profile()
+    start = time.time()
     if isinstance(template, string_types):
         content = render_to_string(template, context_instance=context)
     elif isinstance(template, Template):
         content = template.render(context)
     else:
         content = ''
-    for processor in iterload_objects(get_cms_setting('PLUGIN_PROCESSORS')):
+    if profile is not None:
+        profile.template_time += time.time() - start
+    for processor in get_standard_processors('PLUGIN_PROCESSORS'):
         content = processor(instance, placeholder, content, context)
     for processor in processors:
         content = processor(instance, placeholder, content, context)
@@ -76,6 +117,9 @@ def render_plugins(plugins, context, placeholder, processors=None):
     This is the main plugin rendering utility function, use this function rather than
     Plugin.render_plugin().
     """
+    pool = _get_render_pool(plugins, processors)
+    if pool is not None:
+        return _render_plugins_concurrently(pool, plugins, context, placeholder)
     out = []
     total = len(plugins)
     for index, plugin in enumerate(plugins):
@@ -87,6 +131,106 @@ def render_plugins(plugins, context, placeholder, processors=None):
     return out
 
 
+# (number of threads, ThreadPool) used to render plugins concurrently
+_render_pool = None
+_render_pool_lock = threading.Lock()
+# in_pool is set in the threads of the pool
+_render_state = threading.local()
+
+
+def _get_render_pool(plugins, processors):
+    """
+    Returns the pool of CMS_PLUGIN_RENDER_THREADS threads rendering the plugins
+    or None if they are rendered one after the other.
+    """
+    global _render_pool
+    threads = get_cms_setting('PLUGIN_RENDER_THREADS')
+    if not threads or processors or len(plugins) < 2:
+        return None
+    # a plugin rendered in the pool waits for the plugins it renders itself,
+    # eg the stack plugin, queueing them would exhaust the pool
+    if getattr(_render_state, 'in_pool', False):
+        return None
+    if not any(_is_thread_safe(plugin) for plugin in plugins):
+        return None
+    if _has_uncommitted_changes():
+        return None
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool[0] != threads:
+            if _render_pool is not None:
+                _render_pool[1].close()
+            _render_pool = (threads, ThreadPool(threads))
+        return _render_pool[1]
+
+
+def _is_thread_safe(plugin):
+    try:
+        return plugin.get_plugin_class().thread_safe
+    except KeyError:
+        return False
+
+
+def _has_uncommitted_changes():
+    """
+    The threads use their own database connections, they can't see the rows
+    written in the open transaction of the request.
+    """
+    return any(connection.is_dirty() for connection in connections.all())
+
+
+def _render_plugin_in_thread(plugin, context, placeholder, language):
+    _render_state.in_pool = True
+    try:
+        with force_language(language):
+            content = plugin.render_plugin(context, placeholder)
+    except Exception:
+        # the connection might be unusable
+        for connection in connections.all():
+            connection.close()
+        raise
+    # the connection of the thread is kept for the next plugin, but the
+    # transaction a query might have started must not stay open
+    for connection in connections.all():
+        transaction.commit_unless_managed(using=connection.alias)
+    return content
+
+
+def _render_plugins_concurrently(pool, plugins, context, placeholder):
+    """
+    Renders the thread safe plugins in the threads of the pool and the others
+    in the current thread meanwhile. Every plugin gets its own copy of the
+    context with an empty sekizai container, the sekizai data of the plugins is
+    added to the context in the order of the plugins.
+    """
+    varname = get_varname()
+    language = get_language()
+    total = len(plugins)
+    jobs = []
+    for index, plugin in enumerate(plugins):
+        # the render meta is shared by all instances of a plugin model
+        plugin._render_meta = copy(plugin._render_meta)
+        plugin._render_meta.total = total
+        plugin._render_meta.index = index
+        plugin_context = copy(context)
+        plugin_context.render_context = RenderContext()
+        plugin_context.push()
+        sekizai_data = None
+        if varname in context:
+            sekizai_data = context[varname].__class__()
+            plugin_context[varname] = sekizai_data
+        if _is_thread_safe(plugin):
+            job = pool.apply_async(_render_plugin_in_thread, (plugin, plugin_context, placeholder, language)).get
+        else:
+            job = partial(plugin.render_plugin, plugin_context, placeholder)
+        jobs.append((job, sekizai_data))
+    out = []
+    for job, sekizai_data in jobs:
+        out.append(job())
+        if sekizai_data is not None:
+            restore_sekizai(context, sekizai_data)
+    return out
+
+
 def render_dragables(plugins, slot, request):
     return render_to_string("cms/toolbar/draggable.html", {'plugins': plugins, 'slot': slot, 'request': request})
 
@@ -110,12 +254,33 @@ def render_placeholder(placeholder, context_to_copy, name_fallback="Placeholder"
     # to have a valid language in this function for `get_fallback_languages` to work
     if not lang:
         lang = get_language_from_request(request)
-    plugins = [plugin for plugin in get_plugins(request, placeholder, lang=lang)]
-    # If no plugin is present in the current placeholder we loop in the fallback languages
-    # and get the first available set of plugins
-    if (len(plugins) == 0 and placeholder and lang != get_default_language() and
+
+    # Prepend frontedit toolbar output if applicable
+    edit = False
+    toolbar = getattr(request, 'toolbar', None)
+
+    if (getattr(toolbar, 'edit_mode', False) and
+        (not page or page.has_change_permission(request))):
+        edit = True
+
+    use_cache = not edit and _use_placeholder_cache(placeholder, request)
+    if use_cache:
+        cached_value = get_placeholder_cache(placeholder, lang, settings.SITE_ID, context.get('width'))
+        if cached_value is not None:
+            restore_sekizai(context, cached_value['sekizai'])
+            context.pop()
+            return mark_safe(cached_value['content'])
+        watcher = Watcher(context)
+    fallbacks = []
+    if (placeholder and lang != get_default_language() and
             get_placeholder_conf("language_fallback", placeholder.slot, template, False)):
         fallbacks = get_fallback_languages(lang)
+    # the plugins in the fallback languages are loaded together with the ones
+    # in the current language
+    plugins = [plugin for plugin in get_plugins(request, placeholder, lang=lang, fallback_languages=fallbacks)]
+    # If no plugin is present in the current placeholder we loop in the fallback languages
+    # and get the first available set of plugins
+    if len(plugins) == 0:
         for fallback_language in fallbacks:
             plugins = [plugin for plugin in get_plugins(request, placeholder, fallback_language)]
             if plugins:
@@ -134,13 +299,6 @@ def render_placeholder(placeholder, context_to_copy, name_fallback="Placeholder"
 
     content = []
 
-    # Prepend frontedit toolbar output if applicable
-    edit = False
-    toolbar = getattr(request, 'toolbar', None)
-
-    if (getattr(toolbar, 'edit_mode', False) and
-        (not page or page.has_change_permission(request))):
-        edit = True
     if edit:
         from cms.middleware.toolbar import toolbar_plugin_processor
 
@@ -159,10 +317,34 @@ def render_placeholder(placeholder, context_to_copy, name_fallback="Placeholder"
     result = render_to_string("cms/toolbar/placeholder.html",
                               {'plugins': content, "bar": toolbar_content, "draggables": draggable_content,
                               'edit': edit})
+    if use_cache:
+        set_placeholder_cache(placeholder, lang, settings.SITE_ID, result, watcher.get_changes(),
+                              context.get('width'))
     context.pop()
     return result
 
 
+def _use_placeholder_cache(placeholder, request):
+    """
+    Rendered placeholders are only cached for anonymous GET requests and only
+    if the CMS_PLACEHOLDER_CACHE setting is enabled.
+    """
+    if not placeholder or not placeholder.pk or not get_cms_setting('PLACEHOLDER_CACHE'):
+        return False
+    return is_anonymous_get(request)
+
+
+def is_anonymous_get(request):
+    """
+    Returns True if the request is an anonymous GET request outside of the
+    preview, the only ones rendered content is cached for.
+    """
+    if getattr(request, 'method', 'GET') != 'GET' or 'preview' in getattr(request, 'GET', {}):
+        return False
+    user = getattr(request, 'user', None)
+    return user is None or not user.is_authenticated()
+
+
 def render_placeholder_toolbar(placeholder, context, content, name_fallback=None):
     from cms.plugin_pool import plugin_pool
 
@@ -183,14 +365,15 @@ def render_placeholder_toolbar(placeholder, context, content, name_fallback=None
     else:
         slot = None
     # Builds the list of dictionaries containing module, name and value for the plugin dropdowns
-    installed_plugins = get_toolbar_plugin_struct(plugin_pool.get_all_plugins(slot, page), slot, page)
+    plugins = plugin_pool.get_all_plugins(slot, page)
+    installed_plugins = get_toolbar_plugin_struct(plugins, slot, page)
 
     name = get_placeholder_conf("name", slot, template, title(slot))
     name = _(name)
     context.push()
     context['installed_plugins'] = installed_plugins
     ## to restrict child-only plugins from draggables..
-    context['allowed_plugins'] = [cls.__name__ for cls in plugin_pool.get_all_plugins(slot, page)]
+    context['allowed_plugins'] = [cls.__name__ for cls in plugins]
     context['language'] = get_language_from_request(request)
     context['placeholder_label'] = name
     context['placeholder'] = placeholder
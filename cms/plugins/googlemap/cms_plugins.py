@@ -11,6 +11,7 @@ class GoogleMapPlugin(CMSPluginBase):
     render_template = "cms/plugins/googlemap.html"
     admin_preview = False
     form = GoogleMapForm
+    cache = True
     fieldsets = (
         (None, {
             'fields': ('title', 'address', ('zipcode', 'city',),
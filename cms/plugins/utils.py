@@ -1,10 +1,10 @@
+from array import array
 from collections import defaultdict
-import operator
-from itertools import groupby
 
 from django.utils.translation import ugettext as _
 
 from cms.exceptions import PluginLimitReached
+from cms.models import CMSPlugin
 from cms.plugin_pool import plugin_pool
 from cms.utils import get_language_from_request
 from cms.utils.i18n import get_redirect_on_fallback, get_fallback_languages
@@ -13,12 +13,23 @@ from cms.utils.placeholder import get_placeholder_conf
 from cms.utils.compat.dj import force_unicode
 
 
-def get_plugins(request, placeholder, lang=None):
+def get_plugins(request, placeholder, lang=None, fallback_languages=()):
+    """
+    Returns the plugins of a placeholder in the given language. If they have
+    not been loaded yet, the plugins in the fallback_languages, which are
+    needed if there are none in the given language, are loaded in the same
+    batch.
+    """
     if not placeholder:
         return []
     lang = lang or get_language_from_request(request)
-    if not hasattr(placeholder, '_%s_plugins_cache' % lang):
-        assign_plugins(request, [placeholder], lang)
+    plugins = getattr(placeholder, '_%s_plugins_cache' % lang, None)
+    if plugins:
+        return plugins
+    languages = [language for language in [lang] + list(fallback_languages)
+                 if not hasattr(placeholder, '_%s_plugins_cache' % language)]
+    if languages:
+        assign_plugins(request, [placeholder], languages[0], languages[1:])
     return getattr(placeholder, '_%s_plugins_cache' % lang)
 
 
@@ -33,78 +44,261 @@ def requires_reload(action, plugins):
     return False
 
 
-def assign_plugins(request, placeholders, lang=None):
+def _get_plugin_language(lang, page_languages):
+    """
+    Returns the language the plugins for lang are taken from: a fallback
+    language if the current page has no title in lang and does not redirect
+    to the fallback.
+    """
+    if page_languages is not None and not lang in page_languages and not get_redirect_on_fallback(lang):
+        for fallback in get_fallback_languages(lang):
+            if fallback in page_languages:
+                return fallback
+    return lang
+
+
+def assign_plugins(request, placeholders, lang=None, fallback_languages=()):
     """
     Fetch all plugins for the given ``placeholders`` and
     cast them down to the concrete instances in one query
     per type.
+
+    The plugins in ``fallback_languages`` are fetched in the same queries.
     """
     placeholders = list(placeholders)
     if not placeholders:
         return
     lang = lang or get_language_from_request(request)
-    request_lang = lang
+    page_languages = None
     if hasattr(request, "current_page") and request.current_page is not None:
-        languages = request.current_page.get_languages()
-        if not lang in languages and not get_redirect_on_fallback(lang):
-            fallbacks = get_fallback_languages(lang)
-            for fallback in fallbacks:
-                if fallback in languages:
-                    request_lang = fallback
-                    break
-                    # get all plugins for the given placeholders
-    qs = get_cmsplugin_queryset(request).filter(placeholder__in=placeholders, language=request_lang).order_by(
+        page_languages = request.current_page.get_languages()
+    request_languages = {}
+    for language in [lang] + list(fallback_languages):
+        request_languages[language] = _get_plugin_language(language, page_languages)
+    # get all plugins for the given placeholders
+    qs = get_cmsplugin_queryset(request).filter(
+        placeholder__in=placeholders, language__in=set(request_languages.values())).order_by(
         'placeholder', 'tree_id', 'level', 'position')
     plugin_list = downcast_plugins(qs)
 
-    # split the plugins up by placeholder
-    groups = dict((key, list(plugins)) for key, plugins in groupby(plugin_list, operator.attrgetter('placeholder_id')))
+    # split the plugins up by placeholder and language
+    groups = {}
+    for plugin in plugin_list:
+        groups.setdefault((plugin.placeholder_id, plugin.language), []).append(plugin)
 
     for group in groups:
         groups[group] = build_plugin_tree(groups[group])
-    for placeholder in placeholders:
-        setattr(placeholder, '_%s_plugins_cache' % lang, list(groups.get(placeholder.pk, [])))
+    for language, request_lang in request_languages.items():
+        for placeholder in placeholders:
+            setattr(placeholder, '_%s_plugins_cache' % language,
+                    list(groups.get((placeholder.pk, request_lang), [])))
+
+
+class PluginTree(object):
+    """
+    The plugin tree of a placeholder stored in flat arrays, indexed by the
+    position of the plugins in the list the tree is built from:
+    plugin_ids[i] is the id of a plugin, parents[i] the index of its parent
+    (-1 for root plugins), first_children[i] the index of its first child and
+    next_siblings[i] the index of its next sibling (-1 if there is none).
+
+    The plugins may be in any order, siblings are ordered by their position.
+    Plugins whose parent is not in the list are left out of the tree, together
+    with their descendants.
+
+    Only integers are stored, so trees are cheap to keep and to pickle.
+    """
+    __slots__ = ('plugin_ids', 'parents', 'first_children', 'next_siblings', 'first_root')
+
+    def __init__(self, plugins):
+        plugins = list(plugins)
+        self.plugin_ids = array('l', [plugin.pk for plugin in plugins])
+        self.parents = array('l', [-1]) * len(plugins)
+        self.first_children = array('l', [-1]) * len(plugins)
+        self.next_siblings = array('l', [-1]) * len(plugins)
+        indexes = dict((plugin_id, index) for index, plugin_id in enumerate(self.plugin_ids))
+        children = {}
+        roots = []
+        for index, plugin in enumerate(plugins):
+            if plugin.parent_id:
+                parent = indexes.get(plugin.parent_id, None)
+                if parent is None:
+                    continue
+                self.parents[index] = parent
+                children.setdefault(parent, []).append((plugin.position, index))
+            else:
+                roots.append((plugin.position, index))
+        for parent, siblings in children.items():
+            self.first_children[parent] = self._link_siblings(siblings)
+        self.first_root = self._link_siblings(roots)
+
+    def _link_siblings(self, siblings):
+        """
+        Links the (position, index) tuples of siblings in the order of their
+        positions and returns the index of the first one.
+        """
+        # plugins ordered by (tree_id, level, position) are already in order
+        if any(siblings[i] > siblings[i + 1] for i in range(len(siblings) - 1)):
+            siblings.sort()
+        for (position, index), (next_position, next_index) in zip(siblings, siblings[1:]):
+            self.next_siblings[index] = next_index
+        return siblings[0][1] if siblings else -1
+
+    def __len__(self):
+        return len(self.plugin_ids)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _iter_siblings(self, index):
+        while index != -1:
+            yield index
+            index = self.next_siblings[index]
+
+    def get_roots(self):
+        """
+        Returns the indexes of the root plugins in order.
+        """
+        return list(self._iter_siblings(self.first_root))
+
+    def get_children(self, index):
+        """
+        Returns the indexes of the children of a plugin in order.
+        """
+        return list(self._iter_siblings(self.first_children[index]))
+
+    def get_parent(self, index):
+        """
+        Returns the index of the parent of a plugin or None for root plugins.
+        """
+        parent = self.parents[index]
+        return None if parent == -1 else parent
 
 
 def build_plugin_tree(plugin_list):
-    root = []
+    """
+    Sets child_plugin_instances of the plugins and returns the root plugins.
+
+    The plugins may be in any order. Plugins whose parent is not in the list
+    are skipped, together with their descendants, as in PluginTree.
+    """
+    plugin_list = list(plugin_list)
     cache = {}
     for plugin in plugin_list:
         plugin.child_plugin_instances = []
         cache[plugin.pk] = plugin
+    root = []
+    for plugin in plugin_list:
         if not plugin.parent_id:
             root.append(plugin)
-        else:
-            parent = cache[plugin.parent_id]
-            parent.child_plugin_instances.append(plugin)
-    root.sort(key=lambda x: x.position)
+        elif plugin.parent_id in cache:
+            cache[plugin.parent_id].child_plugin_instances.append(plugin)
+    _sort_by_position(root)
     for plugin in plugin_list:
-        if plugin.child_plugin_instances and len(plugin.child_plugin_instances) > 1:
-            plugin.child_plugin_instances.sort(key=lambda x: x.position)
+        _sort_by_position(plugin.child_plugin_instances)
     return root
 
 
+def _sort_by_position(plugins):
+    # plugins ordered by (tree_id, level, position) are already in order
+    if any(plugins[i].position > plugins[i + 1].position for i in range(len(plugins) - 1)):
+        plugins.sort(key=lambda plugin: plugin.position)
+
+
+# plugin model -> names and attnames of the columns in its own table, or None
+# if the model can't be loaded from its own table only
+_plugin_model_columns = {}
+
+
+def _get_concrete_model(model):
+    while model._meta.proxy:
+        model = model._meta.proxy_for_model
+    return model
+
+
+def _get_plugin_model_columns(model):
+    """
+    Returns a list of (name, attname) tuples of the columns of a direct
+    CMSPlugin subclass, including the parent link. Returns None for models
+    inheriting from another plugin model, those are loaded through the ORM.
+    """
+    if model not in _plugin_model_columns:
+        concrete = _get_concrete_model(model)
+        columns = None
+        if list(concrete._meta.parents) == [CMSPlugin]:
+            columns = [(field.name, field.attname) for field in concrete._meta.local_fields]
+        _plugin_model_columns[model] = columns
+    return _plugin_model_columns[model]
+
+
+def _build_plugin_instance(model, plugin, values):
+    """
+    Builds an instance of the plugin model from the CMSPlugin row and the
+    values of the columns in the plugin model's own table.
+    """
+    kwargs = dict((field.attname, getattr(plugin, field.attname)) for field in CMSPlugin._meta.fields)
+    kwargs.update(values)
+    instance = model(**kwargs)
+    instance._state.db = plugin._state.db
+    instance._state.adding = False
+    for field in CMSPlugin._meta.fields:
+        # keep related objects which have been loaded already, eg the placeholder
+        cache_name = field.get_cache_name()
+        if hasattr(plugin, cache_name):
+            setattr(instance, cache_name, getattr(plugin, cache_name))
+    return instance
+
+
 def downcast_plugins(queryset, select_placeholder=False):
-    plugin_types_map = defaultdict(list)
-    plugin_lookup = {}
+    """
+    Returns the plugins of the queryset as instances of their plugin models.
+
+    The CMSPlugin rows are only fetched once. Plugin types sharing a model are
+    loaded together, plugins using CMSPlugin (or a proxy of it) as their model
+    don't need a query at all and the other models are loaded from their own
+    table only, without joining the CMSPlugin table again.
+    """
+    if select_placeholder and hasattr(queryset, 'select_related'):
+        queryset = queryset.select_related('placeholder')
+    plugins = list(queryset)
+    plugins_by_model = defaultdict(list)
+    for plugin in plugins:
+        plugins_by_model[plugin_pool.get_plugin(plugin.plugin_type).model].append(plugin)
 
-    # make a map of plugin types, needed later for downcasting
-    for plugin in queryset:
-        plugin_types_map[plugin.plugin_type].append(plugin.pk)
-    for plugin_type, pks in plugin_types_map.items():
-        cls = plugin_pool.get_plugin(plugin_type)
-        # get all the plugins of type cls.model
-        plugin_qs = cls.model.objects.filter(pk__in=pks)
-        if select_placeholder:
-            plugin_qs = plugin_qs.select_related('placeholder')
-
-        # put them in a map so we can replace the base CMSPlugins with their
-        # downcasted versions
-        for instance in plugin_qs:
-            plugin_lookup[instance.pk] = instance
-            # make the equivalent list of qs, but with downcasted instances
-    plugin_list = [plugin_lookup[p.pk] for p in queryset if p.pk in plugin_lookup]
-    return plugin_list
+    plugin_lookup = {}
+    for model, model_plugins in plugins_by_model.items():
+        if model is CMSPlugin:
+            for plugin in model_plugins:
+                plugin_lookup[plugin.pk] = plugin
+            continue
+        if _get_concrete_model(model) is CMSPlugin:
+            for plugin in model_plugins:
+                plugin_lookup[plugin.pk] = _build_plugin_instance(model, plugin, {})
+            continue
+        columns = _get_plugin_model_columns(model)
+        if columns is not None:
+            plugins_by_pk = dict((plugin.pk, plugin) for plugin in model_plugins)
+            names = [name for name, attname in columns]
+            attnames = [attname for name, attname in columns]
+            rows = model._default_manager.filter(pk__in=list(plugins_by_pk)).order_by().values_list(*names)
+            for row in rows:
+                values = dict(zip(attnames, row))
+                plugin = plugins_by_pk[values[model._meta.pk.attname]]
+                instance = _build_plugin_instance(model, plugin, values)
+                setattr(instance, model._meta.pk.get_cache_name(), plugin)
+                plugin_lookup[plugin.pk] = instance
+        else:
+            plugin_qs = model._default_manager.filter(pk__in=[plugin.pk for plugin in model_plugins])
+            if select_placeholder:
+                plugin_qs = plugin_qs.select_related('placeholder')
+            for instance in plugin_qs:
+                plugin_lookup[instance.pk] = instance
+    # keep the order of the queryset
+    return [plugin_lookup[plugin.pk] for plugin in plugins if plugin.pk in plugin_lookup]
 
 
 def get_plugins_for_page(request, page, lang=None):
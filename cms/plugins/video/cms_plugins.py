@@ -11,6 +11,7 @@ class VideoPlugin(CMSPluginBase):
     form = VideoForm
     
     render_template = "cms/plugins/video.html"
+    cache = True
     
     general_fields = [
         ('movie', 'movie_url'),
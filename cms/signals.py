@@ -5,6 +5,8 @@ from django.db.models import signals
 from django.dispatch import Signal
 
 from cms.cache.permissions import clear_user_permission_cache, clear_permission_cache
+from cms.cache.page import clear_page_cache, clear_page_cache_path, clear_all_page_cache
+from cms.cache.placeholder import clear_placeholder_cache
 from cms.models import Page, Title, CMSPlugin, PagePermission, GlobalPagePermission, PageUser, PageUserGroup
 from django.conf import settings
 from menus.menu_pool import menu_pool
@@ -34,6 +36,34 @@ def update_plugin_positions(**kwargs):
 signals.post_delete.connect(update_plugin_positions, sender=CMSPlugin, dispatch_uid="cms.plugin.update_position")
 
 
+def invalidate_placeholder_cache(instance, **kwargs):
+    """
+    Invalidates the rendered content of the placeholder a plugin lives in.
+    Not bound to a sender, since plugins are saved as subclasses of CMSPlugin.
+    """
+    if not isinstance(instance, CMSPlugin) or not instance.placeholder_id:
+        return
+    clear_placeholder_cache(instance.placeholder_id)
+    if get_cms_setting('PLACEHOLDER_CACHE') and 'cms.stacks' in settings.INSTALLED_APPS:
+        from cms.stacks.models import Stack
+        # stacks can be rendered in any placeholder, so everything is stale
+        if Stack.objects.filter(content=instance.placeholder_id).exists():
+            clear_placeholder_cache()
+
+
+def invalidate_published_placeholder_cache(instance, **kwargs):
+    public_page = instance.publisher_public
+    if public_page:
+        for placeholder_id in public_page.placeholders.values_list('pk', flat=True):
+            clear_placeholder_cache(placeholder_id)
+
+
+signals.post_save.connect(invalidate_placeholder_cache, dispatch_uid="cms.plugin.invalidate_placeholder_cache")
+signals.post_delete.connect(invalidate_placeholder_cache, dispatch_uid="cms.plugin.invalidate_placeholder_cache")
+post_publish.connect(invalidate_published_placeholder_cache, sender=Page,
+                     dispatch_uid="cms.page.invalidate_placeholder_cache")
+
+
 def update_title_paths(instance, **kwargs):
     """Update child pages paths in case when page was moved.
     """
@@ -106,6 +136,22 @@ def post_save_title(instance, raw, created, **kwargs):
         del instance.tmp_prevent_descendant_update
 
 
+def invalidate_title_page_cache(instance, raw, **kwargs):
+    """
+    Invalidates the cached responses for the old and the new path of a public
+    title. Connected before post_save_title, which still knows the old path
+    and saves the titles of the descendants if the path changed.
+    """
+    if raw or not get_cms_setting('PAGE_CACHE') or instance.page.publisher_is_draft:
+        return
+    site_id = instance.page.site_id
+    clear_page_cache_path(site_id, instance.language, instance.path)
+    old_path = getattr(instance, 'tmp_path', None)
+    if old_path is not None and old_path != instance.path:
+        clear_page_cache_path(site_id, instance.language, old_path)
+
+
+signals.post_save.connect(invalidate_title_page_cache, sender=Title, dispatch_uid="cms.title.invalidate_page_cache")
 signals.post_save.connect(post_save_title, sender=Title, dispatch_uid="cms.title.postsave")
 
 
@@ -192,6 +238,20 @@ def update_placeholders(instance, **kwargs):
 def invalidate_menu_cache(instance, **kwargs):
     menu_pool.clear(instance.site_id)
 
+
+def invalidate_page_cache(instance, **kwargs):
+    """
+    Invalidates the cached responses of a public page, eg when it gets
+    unpublished or deleted.
+    """
+    if get_cms_setting('PAGE_CACHE') and not instance.publisher_is_draft:
+        clear_page_cache(instance)
+
+
+def invalidate_published_page_cache(instance, **kwargs):
+    if get_cms_setting('PAGE_CACHE') and instance.publisher_public:
+        clear_page_cache(instance.publisher_public)
+
 # tell moderator, there is something happening with this page
 signals.pre_save.connect(pre_save_page, sender=Page, dispatch_uid="cms.page.presave")
 signals.post_save.connect(post_save_page_moderator, sender=Page, dispatch_uid="cms.page.postsave")
@@ -199,6 +259,9 @@ signals.post_save.connect(post_save_page, sender=Page)
 signals.post_save.connect(update_placeholders, sender=Page)
 signals.pre_save.connect(invalidate_menu_cache, sender=Page)
 signals.pre_delete.connect(invalidate_menu_cache, sender=Page)
+signals.post_save.connect(invalidate_page_cache, sender=Page, dispatch_uid="cms.page.invalidate_page_cache")
+signals.pre_delete.connect(invalidate_page_cache, sender=Page, dispatch_uid="cms.page.invalidate_page_cache")
+post_publish.connect(invalidate_published_page_cache, sender=Page, dispatch_uid="cms.page.invalidate_published_page_cache")
 
 
 def pre_save_user(instance, raw, **kwargs):
@@ -228,21 +291,33 @@ def _clear_users_permissions(instance):
             clear_user_permission_cache(user)
 
 
+def _clear_page_permission_page_cache(instance):
+    # view restrictions might be inherited, so the descendants are affected too
+    if get_cms_setting('PAGE_CACHE') and instance.page_id and instance.page.publisher_public_id:
+        clear_page_cache(instance.page.publisher_public, include_descendants=True)
+
+
 def pre_save_pagepermission(instance, raw, **kwargs):
     _clear_users_permissions(instance)
+    _clear_page_permission_page_cache(instance)
 
 
 def pre_delete_pagepermission(instance, **kwargs):
     _clear_users_permissions(instance)
+    _clear_page_permission_page_cache(instance)
 
 
 def pre_save_globalpagepermission(instance, raw, **kwargs):
     _clear_users_permissions(instance)
     menu_pool.clear(all=True)
+    if get_cms_setting('PAGE_CACHE'):
+        clear_all_page_cache()
 
 
 def pre_delete_globalpagepermission(instance, **kwargs):
     _clear_users_permissions(instance)
+    if get_cms_setting('PAGE_CACHE'):
+        clear_all_page_cache()
 
 
 def pre_save_delete_page(instance, **kwargs):
@@ -2,8 +2,10 @@ import uuid
 from cms.utils.compat.dj import python_2_unicode_compatible
 
 from django.db import models
+from django.db.models import signals
 from django.utils.translation import ugettext_lazy as _
 
+from cms.cache.placeholder import clear_placeholder_cache
 from cms.models.fields import PlaceholderField
 from cms.models.pluginmodel import CMSPlugin
 
@@ -57,3 +59,12 @@ class StackLink(CMSPlugin):
 
     def __str__(self):
         return self.stack.name
+
+
+def invalidate_placeholder_cache(**kwargs):
+    # stacks can be rendered in any placeholder, so all rendered content is stale
+    clear_placeholder_cache()
+
+
+signals.post_save.connect(invalidate_placeholder_cache, sender=Stack, dispatch_uid="cms.stack.invalidate_placeholder_cache")
+signals.post_delete.connect(invalidate_placeholder_cache, sender=Stack, dispatch_uid="cms.stack.invalidate_placeholder_cache")
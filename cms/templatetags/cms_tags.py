@@ -1,14 +1,15 @@
 # -*- coding: utf-8 -*-
-from itertools import chain
 from datetime import datetime
+import hashlib
 from classytags.arguments import Argument, MultiValueArgument
 from classytags.core import Options, Tag
 from classytags.helpers import InclusionTag, AsTag
 from classytags.parser import Parser
+from cms.cache.placeholder import get_placeholder_cache_version
 from cms.exceptions import PlaceholderNotFound
 from cms.models import Page, Placeholder as PlaceholderModel
 from cms.plugin_pool import plugin_pool
-from cms.plugin_rendering import render_placeholder
+from cms.plugin_rendering import render_placeholder, is_anonymous_get
 from cms.plugins.utils import get_plugins, assign_plugins
 from cms.utils import get_language_from_request, get_cms_setting
 from cms.utils.compat.type_checks import string_types, int_types
@@ -16,7 +17,7 @@ from cms.utils.compat.dj import force_unicode
 from cms.utils.i18n import force_language
 from cms.utils.moderator import use_draft
 from cms.utils.page_resolver import get_page_queryset
-from cms.utils.placeholder import validate_placeholder_name
+from cms.utils.placeholder import validate_placeholder_name, restore_sekizai
 from cms import __version__
 from django import template
 from django.conf import settings
@@ -27,7 +28,7 @@ from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _, get_language
 import re
-from sekizai.helpers import Watcher, get_varname
+from sekizai.helpers import Watcher
 from cms.utils.placeholder import get_toolbar_plugin_struct
 
 
@@ -176,16 +177,44 @@ def _get_placeholder(current_page, page, context, name):
     return placeholder
 
 
+def _get_inherited_placeholders(current_page, context, name):
+    """
+    Returns the placeholders called name of the ancestors of current_page,
+    closest ancestor first. The placeholders and their plugins are loaded for
+    all ancestors at once, regardless of how deep current_page is.
+    """
+    inherited_cache = getattr(current_page, '_tmp_inherited_placeholders_cache', {})
+    if name not in inherited_cache:
+        ancestors = list(current_page.get_cached_ancestors(ascending=True))
+        relations = Page.placeholders.through.objects.filter(
+            page__in=[ancestor.pk for ancestor in ancestors],
+            placeholder__slot=name).select_related('placeholder')
+        placeholders = dict((relation.page_id, relation.placeholder) for relation in relations)
+        assign_plugins(context['request'], placeholders.values(), get_language())
+        inherited_cache[name] = []
+        for ancestor in ancestors:
+            placeholder = placeholders.get(ancestor.pk, None)
+            if placeholder:
+                placeholder.page = ancestor
+                inherited_cache[name].append(placeholder)
+        current_page._tmp_inherited_placeholders_cache = inherited_cache
+    return inherited_cache[name]
+
+
+def _get_placeholders_for_content(context, current_page, name, inherit):
+    yield _get_placeholder(current_page, current_page, context, name)
+    if inherit:
+        for placeholder in _get_inherited_placeholders(current_page, context, name):
+            yield placeholder
+
+
 def get_placeholder_content(context, request, current_page, name, inherit):
     edit_mode = getattr(request, 'toolbar', None) and getattr(request.toolbar, 'edit_mode')
-    pages = [current_page]
     # don't display inherited plugins in edit mode, so that the user doesn't
     # mistakenly edit/delete them. This is a fix for issue #1303. See the discussion
     # there for possible enhancements
-    if inherit and not edit_mode:
-        pages = chain([current_page], current_page.get_cached_ancestors(ascending=True))
-    for page in pages:
-        placeholder = _get_placeholder(current_page, page, context, name)
+    inherit = inherit and not edit_mode
+    for placeholder in _get_placeholders_for_content(context, current_page, name, inherit):
         if placeholder is None:
             continue
         if not get_plugins(request, placeholder):
@@ -272,11 +301,14 @@ class Placeholder(Tag):
 
             return ''
 
-        content = get_placeholder_content(context, request, page, name, inherit)
+        content = self.get_content(context, request, page, name, inherit)
         if not content and nodelist:
             return nodelist.render(context)
         return content
 
+    def get_content(self, context, request, page, name, inherit):
+        return get_placeholder_content(context, request, page, name, inherit)
+
     def get_name(self):
         return self.kwargs['name'].var.value.strip('"').strip("'")
 
@@ -284,6 +316,64 @@ class Placeholder(Tag):
 register.tag(Placeholder)
 
 
+def _get_cached_placeholder_key(page, name, lang, width, inherit):
+    """
+    Returns the cache key for the content of a {% cached_placeholder %} tag.
+    The key changes whenever the page (or one of its ancestors, if the
+    content is inherited) is published and whenever all placeholders are
+    invalidated.
+    """
+    pages = [page]
+    if inherit:
+        pages.extend(page.get_cached_ancestors(ascending=True))
+    version = ','.join('%s:%s' % (p.pk, p.changed_date.isoformat() if p.changed_date else '') for p in pages)
+    version = hashlib.md5(('%s|%s' % (version, get_placeholder_cache_version())).encode('utf-8')).hexdigest()
+    return _clean_key('%s:cached_placeholder:%s:%s:%s:%s:%s:%s:%s' % (
+        get_cms_setting('CACHE_PREFIX'), page.site_id, page.pk, name, lang, width, inherit, version))
+
+
+class CachedPlaceholder(Placeholder):
+    """
+    The same as {% placeholder %}, but the content is cached together with
+    the data the plugins added to sekizai blocks, which is restored when the
+    content is taken from the cache.
+
+    eg: {% cached_placeholder "sidebar" inherit %}
+
+    Only the content of published pages is cached, only for anonymous GET
+    requests and never in edit mode. Plugins whose output varies by request
+    (GET parameters, cookies, ...) must not be put in cached placeholders.
+    """
+    name = 'cached_placeholder'
+    options = PlaceholderOptions(
+        Argument('name', resolve=False),
+        MultiValueArgument('extra_bits', required=False, resolve=False),
+        blocks=[
+            ('endcached_placeholder', 'nodelist'),
+        ]
+    )
+
+    def get_content(self, context, request, page, name, inherit):
+        toolbar = getattr(request, 'toolbar', None)
+        if (page.publisher_is_draft or getattr(toolbar, 'edit_mode', False)
+                or getattr(toolbar, 'build_mode', False) or not is_anonymous_get(request)):
+            return super(CachedPlaceholder, self).get_content(context, request, page, name, inherit)
+        lang = get_language_from_request(request)
+        cache_key = _get_cached_placeholder_key(page, name, lang, context.get('width', None), inherit)
+        cached_value = cache.get(cache_key)
+        if cached_value is not None:
+            restore_sekizai(context, cached_value['sekizai'])
+            return mark_safe(cached_value['content'])
+        watcher = Watcher(context)
+        content = super(CachedPlaceholder, self).get_content(context, request, page, name, inherit)
+        cache.set(cache_key, {'content': force_unicode(content), 'sekizai': watcher.get_changes()},
+                  get_cms_setting('CACHE_DURATIONS')['content'])
+        return content
+
+
+register.tag(CachedPlaceholder)
+
+
 class RenderPlugin(InclusionTag):
     template = 'cms/content.html'
     name = 'render_plugin'
@@ -434,15 +524,6 @@ class CleanAdminListFilter(InclusionTag):
         return {'title': spec.title(), 'choices': unique_choices}
 
 
-def _restore_sekizai(context, changes):
-    varname = get_varname()
-    sekizai_container = context[varname]
-    for key, values in changes.items():
-        sekizai_namespace = sekizai_container[key]
-        for value in values:
-            sekizai_namespace.append(value)
-
-
 def _show_placeholder_for_page(context, placeholder_name, page_lookup, lang=None,
                                site=None, cache_result=True):
     """
@@ -469,7 +550,7 @@ def _show_placeholder_for_page(context, placeholder_name, page_lookup, lang=None
         cache_key = _clean_key('%s_placeholder:%s' % (base_key, placeholder_name))
         cached_value = cache.get(cache_key)
         if isinstance(cached_value, dict): # new style
-            _restore_sekizai(context, cached_value['sekizai'])
+            restore_sekizai(context, cached_value['sekizai'])
             return {'content': mark_safe(cached_value['content'])}
         elif isinstance(cached_value, string_types): # old style
             return {'content': mark_safe(cached_value)}
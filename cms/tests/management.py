@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
+from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.management import CommandError
 from cms.models import Page
@@ -15,6 +16,9 @@ from cms.models.pluginmodel import CMSPlugin
 from cms.models.placeholdermodel import Placeholder
 from djangocms_text_ckeditor.cms_plugins import TextPlugin
 from cms.utils.compat.string_io import StringIO
+import os
+import shutil
+import tempfile
 
 
 APPHOOK = "SampleApp"
@@ -227,6 +231,70 @@ class ManagementTestCase(CMSTestCase):
             self.assertEqual(out.getvalue(), "1 'TextPlugin' plugins uninstalled\n")
             self.assertEqual(CMSPlugin.objects.filter(plugin_type=PLUGIN).count(), 0)
 
+    def test_export(self):
+        page = create_page('home', 'nav_playground.html', 'en', published=True)
+        child = create_page('child', 'nav_playground.html', 'en', parent=page, published=True)
+        add_plugin(child.placeholders.get(slot='body'), TextPlugin, 'en', body='first body')
+        child.publish()
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        site = Site.objects.get_current()
+        child_path = os.path.join(output_dir, site.domain, 'en', 'child', 'index.html')
+
+        def export():
+            out = StringIO()
+            command = cms.Command()
+            command.stdout = out
+            command.stderr = StringIO()
+            command.handle("export", output_dir, interactive=False)
+            return out.getvalue()
+
+        self.assertEqual(export(), "2 pages rendered, 0 unchanged, 0 removed\n")
+        with open(child_path) as f:
+            self.assertTrue('first body' in f.read())
+        self.assertEqual(export(), "0 pages rendered, 2 unchanged, 0 removed\n")
+
+        plugin = CMSPlugin.objects.get(placeholder__page=child, language='en').get_plugin_instance()[0]
+        plugin.body = 'second body'
+        plugin.save()
+        self.reload(child).publish()
+        self.assertEqual(export(), "1 pages rendered, 1 unchanged, 0 removed\n")
+        with open(child_path) as f:
+            self.assertTrue('second body' in f.read())
+
+        # changing an ancestor renders its descendants again
+        page = self.reload(page)
+        page.template = 'col_two.html'
+        page.save()
+        page.publish()
+        self.assertEqual(export(), "2 pages rendered, 0 unchanged, 0 removed\n")
+
+        self.reload(child).unpublish()
+        self.assertEqual(export(), "0 pages rendered, 1 unchanged, 1 removed\n")
+        self.assertFalse(os.path.exists(child_path))
+
+    def test_export_allowed_hosts(self):
+        """
+        The pages of a site are exported even if its domain isn't allowed or
+        pages are streamed, and the settings are restored afterwards.
+        """
+        create_page('home', 'nav_playground.html', 'en', published=True)
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        site = Site.objects.get_current()
+        out = StringIO()
+        command = cms.Command()
+        command.stdout = out
+        command.stderr = StringIO()
+        with SettingsOverride(ALLOWED_HOSTS=['allowed.example.com'], DEBUG=False, CMS_PAGE_STREAMING=True):
+            site_id = settings.SITE_ID
+            command.handle("export", output_dir, interactive=False)
+            self.assertEqual(settings.SITE_ID, site_id)
+            self.assertEqual(settings.ALLOWED_HOSTS, ['allowed.example.com'])
+            self.assertTrue(settings.CMS_PAGE_STREAMING)
+        self.assertEqual(out.getvalue(), "1 pages rendered, 0 unchanged, 0 removed\n")
+        self.assertTrue(os.path.exists(os.path.join(output_dir, site.domain, 'en', 'index.html')))
+
 
 class PageFixtureManagementTestCase(NavextendersFixture, CMSTestCase):
 
@@ -432,4 +500,4 @@ class PageFixtureManagementTestCase(NavextendersFixture, CMSTestCase):
         with self.assertRaises(CommandError) as command_error:
             command.handle("copy-lang", "it", "fr")
 
-        self.assertEqual(str(command_error.exception), 'Both languages have to be present in settings.LANGUAGES and settings.CMS_LANGUAGES')
\ No newline at end of file
+        self.assertEqual(str(command_error.exception), 'Both languages have to be present in settings.LANGUAGES and settings.CMS_LANGUAGES')
@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
 import copy
+import pickle
+import random
+import time
 from django.db import connection
 from cms.api import create_page
-from cms.menu import CMSMenu, get_visible_pages
-from cms.models import Page
-from cms.models.permissionmodels import GlobalPagePermission, PagePermission
+from cms.menu import CMSMenu, get_visible_pages, page_to_node, _get_view_restrictions
+from cms.models import Page, Title
+from cms.models.permissionmodels import (GlobalPagePermission, PagePermission, ACCESS_CHILDREN,
+    ACCESS_DESCENDANTS, ACCESS_PAGE_AND_DESCENDANTS)
 from cms.test_utils.fixtures.menus import (MenusFixture, SubMenusFixture, 
     SoftrootFixture, ExtendedMenusFixture)
 from cms.test_utils.testcases import SettingsOverrideTestCase
@@ -20,8 +24,8 @@ from django.contrib.sites.models import Site
 from django.template import Template, TemplateSyntaxError
 from django.utils.translation import activate
 from menus.base import NavigationNode
-from menus.menu_pool import menu_pool, _build_nodes_inner_for_one_menu
-from menus.models import CacheKey
+from menus.menu_pool import (menu_pool, _build_nodes_inner_for_one_menu, _get_node_views,
+    _get_url_index, _dump_nodes, _load_nodes)
 from menus.utils import mark_descendants, find_selected, cut_levels
 from django.utils.unittest import skipUnless
 
@@ -159,6 +163,22 @@ class FixturesMenuTests(MenusFixture, BaseMenuTest):
         nodes = menu.get_nodes(request)
         self.assertEqual(len(nodes), len(self.get_all_pages()))
 
+    def test_cms_menu_nodes(self):
+        """
+        Tests that CMSMenu builds the same nodes from the loaded columns as
+        page_to_node builds from the pages.
+        """
+        request = self.get_request()
+        nodes = CMSMenu().get_nodes(request)
+        pages = list(self.get_all_pages().order_by('tree_id', 'lft'))
+        home = pages[0]
+        self.assertEqual([node.id for node in nodes], [page.pk for page in pages])
+        for node, page in zip(nodes, pages):
+            page.home_pk_cache = home.pk
+            expected = page_to_node(page, home, False)
+            for name in ('title', 'url', 'id', 'parent_id', 'visible', 'attr'):
+                self.assertEqual(getattr(node, name), getattr(expected, name))
+
     def test_show_menu(self):
         context = self.get_context()
         # test standard show_menu
@@ -180,39 +200,182 @@ class FixturesMenuTests(MenusFixture, BaseMenuTest):
     def test_show_menu_num_queries(self):
         context = self.get_context()
         # test standard show_menu
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(3):
             """
             The queries should be:
                 get all pages
                 get all page permissions
                 get all titles
-                get the menu cache key
-                set the menu cache key
             """
             tpl = Template("{% load menu_tags %}{% show_menu %}")
             tpl.render(context)
 
-    def test_show_menu_cache_key_leak(self):
+    def test_show_menu_cache_versions(self):
+        """
+        Tests that cached menus are used until the menus of their site or
+        language are invalidated.
+        """
         context = self.get_context()
         tpl = Template("{% load menu_tags %}{% show_menu %}")
-        self.assertEqual(CacheKey.objects.count(), 0)
-        tpl.render(context)
-        self.assertEqual(CacheKey.objects.count(), 1)
-        tpl.render(context)
-        self.assertEqual(CacheKey.objects.count(), 1)
 
-    def test_menu_keys_duplicate_truncates(self):
+        def render():
+            with SettingsOverride(DEBUG=True):
+                start = len(connection.queries)
+                tpl.render(context)
+                return len(connection.queries) - start
+
+        with SettingsOverride(CMS_CACHE_DURATIONS={'menus': 60, 'content': 0, 'permissions': 0}):
+            uncached = render()
+            cached = render()
+            self.assertEqual(uncached - cached, 3)
+            # invalidating other sites or languages keeps the cached menu
+            menu_pool.clear(settings.SITE_ID + 1)
+            menu_pool.clear(language='de')
+            menu_pool.clear(settings.SITE_ID, 'de')
+            self.assertEqual(render(), cached)
+            for kwargs in ({'site_id': settings.SITE_ID}, {'language': 'en'},
+                           {'site_id': settings.SITE_ID, 'language': 'en'}, {'all': True}):
+                menu_pool.clear(**kwargs)
+                self.assertEqual(render(), uncached)
+                self.assertEqual(render(), cached)
+
+    def test_menu_output_cache(self):
         """
-        When two objects with the same characteristics are present in the
-        database, get_or_create truncates the database table to "invalidate"
-        the cache, before retrying. This can happen after migrations, and since
-        it's only cache, we don't want any propagation of errors.
+        Tests that the output of the menu tags is cached per selected node
+        until the menus are invalidated.
         """
-        CacheKey.objects.create(language="fr", site=1, key="a")
-        CacheKey.objects.create(language="fr", site=1, key="a")
-        CacheKey.objects.get_or_create(language="fr", site=1, key="a")
-
-        self.assertEqual(CacheKey.objects.count(), 1)
+        tpl = Template("{% load menu_tags %}{% show_menu %}|{% show_sub_menu %}|{% show_breadcrumb %}")
+        page2 = self.get_page(2)
+        with SettingsOverride(CMS_MENU_OUTPUT_CACHE=True,
+                              CMS_CACHE_DURATIONS={'menus': 60, 'content': 0, 'permissions': 0}):
+            output = tpl.render(self.get_context())
+            page2_output = tpl.render(self.get_context(path=page2.get_absolute_url()))
+            self.assertNotEqual(output, page2_output)
+            contexts = [self.get_context(), self.get_context(path=page2.get_absolute_url())]
+            with self.assertNumQueries(0):
+                self.assertEqual(tpl.render(contexts[0]), output)
+                self.assertEqual(tpl.render(contexts[1]), page2_output)
+            Title.objects.filter(page=page2).update(menu_title='changed')
+            self.assertEqual(tpl.render(self.get_context(path=page2.get_absolute_url())), page2_output)
+            menu_pool.clear(settings.SITE_ID)
+            changed_output = tpl.render(self.get_context(path=page2.get_absolute_url()))
+            self.assertNotEqual(changed_output, page2_output)
+            self.assertTrue('changed' in changed_output)
+
+    def test_get_nodes_copies(self):
+        """
+        Tests that every call to get_nodes returns its own nodes, while the
+        nodes are only loaded once per request.
+        """
+        request = self.get_request(self.get_page(2).get_absolute_url())
+        with SettingsOverride(CMS_CACHE_DURATIONS={'menus': 60, 'content': 0, 'permissions': 0}):
+            nodes = menu_pool.get_nodes(request)
+            with self.assertNumQueries(0):
+                other_nodes = menu_pool.get_nodes(request)
+        self.assertEqual([node.id for node in nodes], [node.id for node in other_nodes])
+        for node, other_node in zip(nodes, other_nodes):
+            self.assertFalse(node is other_node)
+            self.assertEqual(node.attr, other_node.attr)
+            for child in node.children:
+                self.assertTrue(any(child is n for n in nodes))
+            if node.parent:
+                self.assertTrue(any(node.parent is n for n in nodes))
+        self.assertFalse(other_nodes[0].selected)
+        nodes[0].selected = True
+        nodes[0].children.append(nodes[-1])
+        nodes[0].attr['changed'] = True
+        self.assertFalse(other_nodes[0].selected)
+        self.assertFalse(any(nodes[-1] is n for n in other_nodes[0].children))
+        self.assertFalse(nodes[0].attr is other_nodes[0].attr)
+        self.assertFalse('changed' in other_nodes[0].attr)
+
+    def test_dump_nodes(self):
+        """
+        Tests that nodes are cached without their parents and children, which
+        are rebuilt when the nodes are loaded.
+        """
+        nodes = [
+            NavigationNode('1', '/1/', 1, attr={'key': 'value'}),
+            NavigationNode('2', '/2/', 2, 1),
+            NavigationNode('3', '/3/', 3, 2, visible=False),
+            NavigationNode('4', '/4/', 4, 1),
+            NavigationNode('5', '/5/', 5),
+        ]
+        nodes[2].softroot = True
+        nodes = _build_nodes_inner_for_one_menu(nodes, 'test')
+        dumped = _dump_nodes(nodes)
+        for node in dumped:
+            self.assertFalse(any(isinstance(value, NavigationNode) for value in node[2]))
+        loaded = _load_nodes(pickle.loads(pickle.dumps(dumped, pickle.HIGHEST_PROTOCOL)))
+        for node, loaded_node in zip(nodes, loaded):
+            self.assertEqual(loaded_node.__class__, NavigationNode)
+            for name in ('title', 'url', 'id', 'parent_id', 'parent_namespace', 'namespace', 'visible', 'attr'):
+                self.assertEqual(getattr(loaded_node, name), getattr(node, name))
+            self.assertEqual([child.id for child in loaded_node.children], [child.id for child in node.children])
+            for child in loaded_node.children:
+                self.assertTrue(child.parent is loaded_node)
+        self.assertEqual(loaded[2].softroot, True)
+        self.assertEqual(loaded[2].extra, {'softroot': True})
+        # nodes without other attributes have no extra dictionary
+        self.assertFalse(hasattr(loaded[0], 'extra'))
+        self.assertFalse(hasattr(loaded[0], 'softroot'))
+        self.assertFalse(loaded[0].selected)
+        self.assertFalse(hasattr(loaded[0], '__dict__'))
+
+    def test_mark_selected(self):
+        """
+        Tests that the node with the longest url the path starts with is
+        selected, the first one if several nodes have that url.
+        """
+        def get_selected(path, nodes):
+            request = self.get_request(path)
+            with_index = menu_pool._mark_selected(request, _get_node_views(nodes), _get_url_index(nodes))
+            without_index = menu_pool._mark_selected(request, _get_node_views(nodes))
+            self.assertEqual([node.selected for node in with_index], [node.selected for node in without_index])
+            selected = [node.id for node in with_index if node.selected]
+            self.assertTrue(len(selected) <= 1)
+            return selected[0] if selected else None
+
+        nodes = [
+            NavigationNode('1', '/en/', 1),
+            NavigationNode('2', '/en/a/', 2, 1),
+            NavigationNode('3', '/en/a/b/', 3, 2),
+            NavigationNode('4', '/en/a/b/', 4, 2),
+            NavigationNode('5', '/en/ab/', 5, 1),
+        ]
+        self.assertEqual(get_selected('/en/a/b/', nodes), 3)
+        self.assertEqual(get_selected('/en/a/b/c/', nodes), 3)
+        self.assertEqual(get_selected('/en/a/', nodes), 2)
+        self.assertEqual(get_selected('/en/abc/', nodes), 1)
+        self.assertEqual(get_selected('/en/x/', nodes), 1)
+        self.assertEqual(get_selected('/de/', nodes), None)
+        self.assertEqual(get_selected('/', nodes), None)
+
+    def test_menu_cache_shared_by_visibility(self):
+        """
+        Tests that users who can see the same pages share the cached menu.
+        """
+        menu = menu_pool.menus['CMSMenu']
+        calls = []
+
+        def get_nodes(request):
+            calls.append(request.user)
+            return CMSMenu.get_nodes(menu, request)
+
+        menu.get_nodes = get_nodes
+        self.addCleanup(delattr, menu, 'get_nodes')
+        user1 = User.objects.create_user('user1', 'user1@domain.com', 'user1')
+        user2 = User.objects.create_user('user2', 'user2@domain.com', 'user2')
+        staff = User.objects.create_user('staff', 'staff@domain.com', 'staff')
+        staff.is_staff = True
+        staff.save()
+        tpl = Template("{% load menu_tags %}{% show_menu %}")
+        with SettingsOverride(CMS_CACHE_DURATIONS={'menus': 60, 'content': 0, 'permissions': 0}):
+            for user in (user1, user2, staff, user1):
+                context = self.get_context()
+                context['request'].user = user
+                tpl.render(context)
+        self.assertEqual(calls, [user1, staff])
 
     def test_only_active_tree(self):
         context = self.get_context()
@@ -537,6 +700,37 @@ class MenuTests(BaseMenuTest):
         self.assertEqual(node4.children, [node3])
         self.assertEqual(node5.children, [node4])
 
+    def test_build_nodes_inner_for_large_menu(self):
+        """
+        Benchmarks building trees of 50000 nodes in the worst case order
+        (every node before its parent) and in random order, which used to
+        take quadratic time.
+        """
+        count = 50000
+        nodes = [NavigationNode('Test%s' % i, '/test%s/' % i, i, i - 1 if i > 1 else None)
+                 for i in range(count, 0, -1)]
+        start = time.time()
+        final_list = _build_nodes_inner_for_one_menu(list(nodes), 'Test')
+        duration = time.time() - start
+        self.assertEqual([node.id for node in final_list], list(range(1, count + 1)))
+        self.assertEqual(nodes[0].parent, nodes[1])
+        self.assertEqual(nodes[-1].children, [nodes[-2]])
+        self.assertTrue(duration < 10, duration)
+
+        rng = random.Random(42)
+        nodes = [NavigationNode('Test%s' % i, '/test%s/' % i, i, rng.randint(1, i - 1) if i > 1 else None)
+                 for i in range(1, count + 1)]
+        # a broken branch
+        nodes.append(NavigationNode('Broken', '/broken/', count + 1, count + 2))
+        shuffled = list(nodes)
+        rng.shuffle(shuffled)
+        start = time.time()
+        final_list = _build_nodes_inner_for_one_menu(shuffled, 'Test')
+        duration = time.time() - start
+        self.assertEqual(len(final_list), count)
+        self.assertTrue(all(node.parent is None or node.parent.id == node.parent_id for node in final_list))
+        self.assertTrue(duration < 10, duration)
+
     def test_build_nodes_inner_for_circular_menu(self):
         '''
         TODO: 
@@ -798,14 +992,12 @@ class ShowSubMenuCheck(SubMenusFixture, BaseMenuTest):
         page = self.get_page(6)
         context = self.get_context(page.get_absolute_url())
         # test standard show_menu
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(3):
             """
             The queries should be:
                 get all pages
                 get all page permissions
                 get all titles
-                get the menu cache key
-                set the menu cache key
             """
             tpl = Template("{% load menu_tags %}{% show_sub_menu %}")
             tpl.render(context)
@@ -865,14 +1057,12 @@ class ShowMenuBelowIdTests(BaseMenuTest):
 
         with LanguageOverride('en'):
             context = self.get_context(a.get_absolute_url())
-            with self.assertNumQueries(5):
+            with self.assertNumQueries(3):
                 """
                 The queries should be:
                     get all pages
                     get all page permissions
                     get all titles
-                    get the menu cache key
-                    set the menu cache key
                 """
                 # Actually seems to run:
                 tpl = Template("{% load menu_tags %}{% show_menu_below_id 'a' 0 100 100 100 %}")
@@ -1159,6 +1349,39 @@ class ViewPermissionMenuTests(SettingsOverrideTestCase):
             """
             get_visible_pages(request, pages, site)
 
+    def test_view_restrictions(self):
+        """
+        Tests that view permissions restrict the pages of their grant and are
+        evaluated with a fixed number of queries.
+        """
+        user1 = User.objects.create_user('user1', 'user1@domain.com', 'user1')
+        user2 = User.objects.create_user('user2', 'user2@domain.com', 'user2')
+        group = Group.objects.create(name='testgroup')
+        group.user_set.add(user2)
+        page_a = create_page('A', 'nav_playground.html', 'en')
+        page_b = create_page('B', 'nav_playground.html', 'en', parent=page_a)
+        page_c = create_page('C', 'nav_playground.html', 'en', parent=page_b)
+        page_d = create_page('D', 'nav_playground.html', 'en', parent=page_a)
+        page_e = create_page('E', 'nav_playground.html', 'en')
+        PagePermission.objects.create(can_view=True, user=user1, page=page_a, grant_on=ACCESS_CHILDREN)
+        PagePermission.objects.create(can_view=True, group=group, page=page_b, grant_on=ACCESS_PAGE_AND_DESCENDANTS)
+        PagePermission.objects.create(can_view=True, user=user2, page=page_e, grant_on=ACCESS_DESCENDANTS)
+        pages = list(Page.objects.drafts().order_by('tree_id', 'lft'))
+        with self.assertNumQueries(3):
+            """
+            The queries are:
+            PagePermission query
+            Page query for the trees with permissions
+            Group query for the user
+            """
+            restricted, granted = _get_view_restrictions(user2)
+        self.assertEqual(restricted, set([page_a.pk, page_b.pk, page_c.pk, page_d.pk, page_e.pk]))
+        self.assertEqual(granted, set([page_b.pk, page_c.pk]))
+        self.assertEqual(get_visible_pages(self.get_request(user1), pages), [page_b.pk, page_d.pk])
+        self.assertEqual(get_visible_pages(self.get_request(user2), pages), [page_b.pk, page_c.pk])
+        self.assertEqual(get_visible_pages(self.get_request(), pages), [])
+
+
 class SoftrootTests(SettingsOverrideTestCase):
     """
     Ask evildmp/superdmp if you don't understand softroots!
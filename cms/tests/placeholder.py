@@ -7,8 +7,10 @@ from cms.api import add_plugin, create_page, create_title
 from cms.exceptions import DuplicatePlaceholderWarning
 from cms.models.fields import PlaceholderField
 from cms.models.placeholdermodel import Placeholder
+from cms.plugin_base import CMSPluginBase
 from cms.plugin_pool import plugin_pool
 from cms.plugin_rendering import render_placeholder
+from cms.plugins.utils import get_plugins
 from cms.plugins.link.cms_plugins import LinkPlugin
 from cms.utils.compat.tests import UnittestCompatMixin
 from djangocms_text_ckeditor.cms_plugins import TextPlugin
@@ -25,7 +27,9 @@ from cms.test_utils.testcases import CMSTestCase
 from cms.test_utils.util.context_managers import (SettingsOverride, UserLoginContext)
 from cms.test_utils.util.mock import AttributeObject
 from cms.utils.compat.dj import force_unicode
-from cms.utils.placeholder import PlaceholderNoAction, MLNGPlaceholderActions
+from cms.utils.i18n import force_language
+from cms.utils.placeholder import (PlaceholderNoAction, MLNGPlaceholderActions, get_toolbar_plugin_struct,
+                                   get_placeholder_conf)
 from cms.utils.plugins import get_placeholders
 from django.conf import settings
 from django.contrib import admin
@@ -35,11 +39,19 @@ from django.contrib.messages.storage import default_storage
 from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import reverse
 from django.db.models import Model
+from django.utils.functional import lazy
+from django.utils.translation import get_language
 from django.http import HttpResponseForbidden, HttpResponse
 from django.template import TemplateSyntaxError, Template
+from django.template import loader as template_loader
+from django.template.loader import get_template
+from django.template.loaders.cached import Loader as CachedLoader
 from django.template.context import Context, RequestContext
 from django.test import TestCase
 import itertools
+import os
+import shutil
+import tempfile
 
 
 class PlaceholderTestCase(CMSTestCase, UnittestCompatMixin):
@@ -197,6 +209,42 @@ class PlaceholderTestCase(CMSTestCase, UnittestCompatMixin):
             response = self.client.post(pl_url, {})
             self.assertContains(response, "CMS.API.Helpers.reloadBrowser")
 
+    def test_placeholder_scanning_cache(self):
+        # set up the template loaders
+        get_template('placeholder_tests/base.html')
+        source_loaders = template_loader.template_source_loaders
+        template_dir = tempfile.mkdtemp()
+        path = os.path.join(template_dir, 'placeholder_cache_test.html')
+        try:
+            # the files are checked outside of debug mode too
+            with SettingsOverride(TEMPLATE_DIRS=[template_dir], DEBUG=False, TEMPLATE_DEBUG=False):
+                with open(path, 'w') as template:
+                    template.write('{% load cms_tags %}{% placeholder "one" %}')
+                # whole seconds, so os.utime can set the same time again
+                mtime = int(os.path.getmtime(path))
+                os.utime(path, (mtime, mtime))
+                self.assertEqual(get_placeholders('placeholder_cache_test.html'), [u'one'])
+                with open(path, 'w') as template:
+                    template.write('{% load cms_tags %}{% placeholder "two" %}')
+                # the template is not scanned again as long as it is not modified
+                os.utime(path, (mtime, mtime))
+                self.assertEqual(get_placeholders('placeholder_cache_test.html'), [u'one'])
+                os.utime(path, (mtime + 10, mtime + 10))
+                self.assertEqual(get_placeholders('placeholder_cache_test.html'), [u'two'])
+                # with the cached loader, the result is kept until it is reset
+                cached_loader = CachedLoader(['django.template.loaders.filesystem.Loader'])
+                template_loader.template_source_loaders = (cached_loader,) + source_loaders
+                self.assertEqual(get_placeholders('placeholder_cache_test.html'), [u'two'])
+                with open(path, 'w') as template:
+                    template.write('{% load cms_tags %}{% placeholder "three" %}')
+                os.utime(path, (mtime + 20, mtime + 20))
+                self.assertEqual(get_placeholders('placeholder_cache_test.html'), [u'two'])
+                cached_loader.reset()
+                self.assertEqual(get_placeholders('placeholder_cache_test.html'), [u'three'])
+        finally:
+            template_loader.template_source_loaders = source_loaders
+            shutil.rmtree(template_dir)
+
     def test_placeholder_scanning_fail(self):
         self.assertRaises(TemplateSyntaxError, get_placeholders, 'placeholder_tests/test_eleven.html')
 
@@ -340,6 +388,23 @@ class PlaceholderTestCase(CMSTestCase, UnittestCompatMixin):
             content_de = render_placeholder(placeholder_de, context_de)
             self.assertRegexpMatches(content_de, "^de body$")
 
+    def test_plugins_language_fallback_queries(self):
+        """
+        Tests that the plugins in the fallback languages are loaded in the
+        same queries as the ones in the requested language.
+        """
+        page_en = create_page('page_en', 'col_two.html', 'en')
+        create_title("de", "page_de", page_en)
+        add_plugin(page_en.placeholders.get(slot='col_left'), TextPlugin, 'en', body='en body')
+        placeholder = page_en.placeholders.get(slot='col_left')
+        request = self.get_request(language="de", page=page_en)
+        page_en.get_languages()
+        # one query for the plugins in both languages, one for the text plugins
+        with self.assertNumQueries(2):
+            self.assertEqual(get_plugins(request, placeholder, 'de', fallback_languages=['en']), [])
+            plugins = get_plugins(request, placeholder, 'en')
+        self.assertEqual([plugin.body for plugin in plugins], ['en body'])
+
     def test_placeholder_pk_thousands_format(self):
         page = create_page("page", "nav_playground.html", "en", published=True)
         for placeholder in page.placeholders.all():
@@ -780,6 +845,92 @@ class PlaceholderConfTests(TestCase):
             self.assertEqual(len(plugins), 1, plugins)
             self.assertEqual(plugins[0], LinkPlugin)
 
+    def test_get_placeholder_conf(self):
+        conf = {
+            'main': {
+                'name': 'Main',
+                'plugins': ['TextPlugin'],
+            },
+            'col_two.html main': {
+                'name': '',
+                'plugins': ['LinkPlugin'],
+            },
+        }
+        with SettingsOverride(CMS_PLACEHOLDER_CONF=conf):
+            self.assertEqual(get_placeholder_conf('plugins', 'main'), ['TextPlugin'])
+            self.assertEqual(get_placeholder_conf('plugins', 'main', 'col_two.html'), ['LinkPlugin'])
+            self.assertEqual(get_placeholder_conf('plugins', 'main', 'col_three.html'), ['TextPlugin'])
+            # empty values fall back to the configuration without template
+            self.assertEqual(get_placeholder_conf('name', 'main', 'col_two.html'), 'Main')
+            self.assertEqual(get_placeholder_conf('limits', 'main', 'col_two.html', {}), {})
+            self.assertEqual(get_placeholder_conf('name', 'other', default='Other'), 'Other')
+            self.assertEqual(get_placeholder_conf('name', None, default='None'), 'None')
+        with SettingsOverride(CMS_PLACEHOLDER_CONF={'main': {'name': 'Changed'}}):
+            self.assertEqual(get_placeholder_conf('name', 'main', 'col_two.html'), 'Changed')
+            self.assertEqual(get_placeholder_conf('plugins', 'main', 'col_two.html'), None)
+
+    def test_get_all_plugins_cache(self):
+        page = create_page('page', 'col_two.html', 'en')
+        placeholder = page.placeholders.get(slot='col_left')
+        conf = {
+            'col_left': {
+                'plugins': ['LinkPlugin'],
+            },
+        }
+        with SettingsOverride(CMS_PLACEHOLDER_CONF=conf):
+            plugins = plugin_pool.get_all_plugins(placeholder, page)
+            self.assertEqual(plugins, [LinkPlugin])
+            struct = get_toolbar_plugin_struct(plugins, 'col_left', page)
+            self.assertEqual([item['value'] for item in struct], ['LinkPlugin'])
+            struct[0]['name'] = 'changed'
+            self.assertNotEqual(get_toolbar_plugin_struct(plugins, 'col_left', page)[0]['name'], 'changed')
+            # returned lists can be changed without affecting the cache
+            plugins.append(TextPlugin)
+            self.assertEqual(plugin_pool.get_all_plugins(placeholder, page), [LinkPlugin])
+        conf = {
+            'col_left': {
+                'plugins': ['TextPlugin'],
+            },
+        }
+        with SettingsOverride(CMS_PLACEHOLDER_CONF=conf):
+            self.assertEqual(plugin_pool.get_all_plugins(placeholder, page), [TextPlugin])
+            with SettingsOverride(CMS_PLACEHOLDER_CONF={}):
+                plugins_before = plugin_pool.get_all_plugins(placeholder, page)
+
+                class CachedDumbPlugin(CMSPluginBase):
+                    name = 'Cached dumb plugin'
+
+                plugin_pool.register_plugin(CachedDumbPlugin)
+                try:
+                    plugins = plugin_pool.get_all_plugins(placeholder, page)
+                    self.assertEqual(len(plugins), len(plugins_before) + 1)
+                    self.assertTrue(CachedDumbPlugin in plugins)
+                finally:
+                    plugin_pool.unregister_plugin(CachedDumbPlugin)
+                self.assertEqual(plugin_pool.get_all_plugins(placeholder, page), plugins_before)
+
+    def test_get_all_plugins_cache_language(self):
+        """
+        The plugins are sorted by their translated modules, so they are cached
+        per language.
+        """
+        page = create_page('page', 'col_two.html', 'en')
+        placeholder = page.placeholders.get(slot='col_left')
+
+        class TranslatedModulePlugin(CMSPluginBase):
+            name = 'Translated module plugin'
+            module = lazy(lambda: 'AAA' if get_language() == 'de' else 'ZZZ', str)()
+
+        plugin_pool.register_plugin(TranslatedModulePlugin)
+        try:
+            with SettingsOverride(CMS_PLACEHOLDER_CONF={}):
+                with force_language('en'):
+                    self.assertEqual(plugin_pool.get_all_plugins(placeholder, page)[-1], TranslatedModulePlugin)
+                with force_language('de'):
+                    self.assertEqual(plugin_pool.get_all_plugins(placeholder, page)[0], TranslatedModulePlugin)
+        finally:
+            plugin_pool.unregister_plugin(TranslatedModulePlugin)
+
 
 class PlaceholderI18NTest(CMSTestCase):
     def _testuser(self):
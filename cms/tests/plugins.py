@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
+import pickle
 import datetime
 import json
 
@@ -12,7 +13,7 @@ from cms.plugin_base import CMSPluginBase
 from cms.plugin_pool import plugin_pool
 from cms.plugins.googlemap.models import GoogleMap
 from cms.plugins.inherit.cms_plugins import InheritPagePlaceholderPlugin
-from cms.plugins.utils import get_plugins_for_page
+from cms.plugins.utils import get_plugins_for_page, downcast_plugins, build_plugin_tree, PluginTree
 from cms.plugins.file.models import File
 from cms.plugins.inherit.models import InheritPagePlaceholder
 from cms.plugins.link.forms import LinkForm
@@ -39,6 +40,8 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
 from django.forms.widgets import Media
 from django.test.testcases import TestCase
+from sekizai.context_processors import sekizai
+from sekizai.helpers import get_varname as get_sekizai_varname
 import os
 
 
@@ -568,6 +571,36 @@ class PluginsTestCase(PluginsTestBaseCase):
             'https://maps-api-ssl.google.com/maps/api/js?v=3&sensor=true' in response.content.decode('utf8'),
             response.content)
 
+    def test_plugin_cache(self):
+        """
+        Tests that the output of plugins with cache = True is cached together
+        with its sekizai data and invalidated when the plugin is saved.
+        """
+        page = create_page("cache test", "nav_playground.html", "en")
+        body = page.placeholders.get(slot="body")
+        plugin = add_plugin(body, "GoogleMapPlugin", "en", title="Cached map",
+                            address="Riedtlistrasse 16", zipcode="8006", city="Zurich")
+        script = 'https://maps-api-ssl.google.com/maps/api/js?v=3&sensor=true'
+
+        def render():
+            context = self.get_context(page=page)
+            context.update(sekizai(context['request']))
+            output = self.reload(plugin).render_plugin(context, body)
+            return output, u''.join(context[get_sekizai_varname()]['js'])
+
+        with SettingsOverride(CMS_CACHE_DURATIONS={'menus': 0, 'content': 60, 'permissions': 0}):
+            output, js = render()
+            self.assertIn('Cached map', output)
+            self.assertIn(script, js)
+            # updating the table directly does not invalidate the cache
+            GoogleMap.objects.filter(pk=plugin.pk).update(title="Changed map")
+            output, js = render()
+            self.assertIn('Cached map', output)
+            self.assertIn(script, js)
+            self.reload(plugin).save()
+            output, js = render()
+            self.assertIn('Changed map', output)
+
     def test_inherit_plugin_with_empty_plugin(self):
         inheritfrompage = create_page('page to inherit from',
                                       'nav_playground.html',
@@ -761,6 +794,71 @@ class PluginsTestCase(PluginsTestBaseCase):
         build_plugin_tree(page.placeholders.get(slot='right-column').get_plugins_list())
         plugin_pool.unregister_plugin(DumbFixturePlugin)
 
+    def test_downcast_plugins(self):
+        page = create_page("downcast", "nav_playground.html", "en")
+        body = page.placeholders.get(slot="body")
+        text = add_plugin(body, "TextPlugin", "en", body="downcast text")
+        link = add_plugin(body, "LinkPlugin", "en", name="downcast link", url="http://example.com/")
+        dumb = add_plugin(body, "DumbFixturePluginWithUrls", "en")
+        add_plugin(body, "TextPlugin", "en", body="more text")
+        queryset = CMSPlugin.objects.filter(placeholder=body).order_by('position')
+        # one query for the CMSPlugin rows and one per table, none for plugins
+        # without a table of their own
+        with self.assertNumQueries(3):
+            plugins = downcast_plugins(queryset)
+        self.assertEqual([plugin.pk for plugin in plugins],
+                         list(queryset.values_list('pk', flat=True)))
+        self.assertEqual([plugin.__class__ for plugin in plugins], [Text, Link, CMSPlugin, Text])
+        self.assertEqual(plugins[0].body, "downcast text")
+        self.assertEqual(plugins[0].placeholder_id, body.pk)
+        self.assertEqual(plugins[1].name, "downcast link")
+        self.assertEqual(plugins[1].url, "http://example.com/")
+        self.assertEqual(plugins[2].pk, dumb.pk)
+        self.assertEqual(plugins[3].body, "more text")
+        # the instances can be saved as usual
+        plugins[1].name = "changed link"
+        plugins[1].save()
+        self.assertEqual(Link.objects.get(pk=link.pk).name, "changed link")
+        self.assertEqual(Text.objects.get(pk=text.pk).body, "downcast text")
+
+    def test_plugin_tree(self):
+        page = create_page("tree", "nav_playground.html", "en")
+        body = page.placeholders.get(slot="body")
+        first = add_plugin(body, "TextPlugin", "en", body="first")
+        first_child = add_plugin(body, "TextPlugin", "en", body="first child", target=first)
+        second_child = add_plugin(body, "TextPlugin", "en", body="second child", target=first)
+        grandchild = add_plugin(body, "TextPlugin", "en", body="grandchild", target=first_child)
+        second = add_plugin(body, "TextPlugin", "en", body="second")
+        plugins = list(CMSPlugin.objects.filter(placeholder=body).order_by('tree_id', 'level', 'position'))
+        pks = [plugin.pk for plugin in plugins]
+
+        tree = pickle.loads(pickle.dumps(PluginTree(plugins)))
+        self.assertEqual(len(tree), 5)
+        self.assertEqual([tree.plugin_ids[index] for index in tree.get_roots()], [first.pk, second.pk])
+        self.assertEqual([tree.plugin_ids[index] for index in tree.get_children(pks.index(first.pk))],
+                         [first_child.pk, second_child.pk])
+        self.assertEqual(tree.get_parent(pks.index(grandchild.pk)), pks.index(first_child.pk))
+        self.assertEqual(tree.get_parent(pks.index(first.pk)), None)
+
+        roots = build_plugin_tree(plugins)
+        self.assertEqual([plugin.pk for plugin in roots], [first.pk, second.pk])
+        self.assertEqual([plugin.pk for plugin in roots[0].child_plugin_instances],
+                         [first_child.pk, second_child.pk])
+        self.assertEqual(roots[1].child_plugin_instances, [])
+
+        # any order works, eg the lft order of get_plugins_list
+        roots = build_plugin_tree(reversed(plugins))
+        self.assertEqual([plugin.pk for plugin in roots], [first.pk, second.pk])
+        self.assertEqual([plugin.pk for plugin in roots[0].child_plugin_instances],
+                         [first_child.pk, second_child.pk])
+        roots = build_plugin_tree(body.get_plugins_list())
+        self.assertEqual([plugin.pk for plugin in roots], [first.pk, second.pk])
+
+        # plugins whose parent is missing are skipped
+        orphans = [plugin for plugin in plugins if plugin.pk != first.pk]
+        roots = build_plugin_tree(orphans)
+        self.assertEqual([plugin.pk for plugin in roots], [second.pk])
+
     def test_get_plugins_for_page(self):
         page_en = create_page("PluginOrderPage", "col_two.html", "en",
                               slug="page1", published=True, in_navigation=True)
@@ -1215,7 +1313,7 @@ class PluginManyToManyTestCase(PluginsTestBaseCase):
         self.assertEquals(CMSPlugin.objects.filter(language=self.FIRST_LANG).count(), 1)
         self.assertEquals(CMSPlugin.objects.filter(language=self.SECOND_LANG).count(), 1)
         self.assertEquals(CMSPlugin.objects.count(), 2)
-        db_counts = [plugin.sections.count() for plugin in ArticlePluginModel.objects.all()]
+        db_counts = [article.sections.count() for article in ArticlePluginModel.objects.all()]
         expected = [self.section_count for i in range(len(db_counts))]
         self.assertEqual(expected, db_counts)
 
@@ -1,16 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from cms import plugin_rendering
 from cms.api import create_page, add_plugin
 from cms.models.placeholdermodel import Placeholder
 from cms.models.pluginmodel import CMSPlugin
-from cms.plugin_rendering import render_plugins, PluginContext, render_placeholder_toolbar
+from cms.plugins.googlemap.cms_plugins import GoogleMapPlugin
+from cms.plugins.googlemap.models import GoogleMap
+from djangocms_text_ckeditor.cms_plugins import TextPlugin
+from cms.plugin_rendering import render_plugins, render_placeholder, PluginContext, render_placeholder_toolbar
+from cms.stacks.cms_plugins import StackPlugin
+from cms.stacks.models import Stack
 from cms.test_utils.testcases import SettingsOverrideTestCase
 from cms.test_utils.util.context_managers import SettingsOverride, ChangeModel
 from cms.test_utils.util.mock import AttributeObject
+from cms.utils.profiler import plugin_rendered, get_plugin_profiles, summarize_plugin_profiles
 from django.contrib.auth.models import User
+from django.db import connection, connections
 from django.template import Template, RequestContext
 from sekizai.context import SekizaiContext
+from sekizai.helpers import get_varname
 
 TEMPLATE_NAME = 'tests/rendering/base.html'
 
@@ -33,6 +43,36 @@ def sample_plugin_context_processor(instance, placeholder, original_context):
     }
 
 
+def _share_connection(shared):
+    connections['default'] = shared
+
+
+@contextmanager
+def render_in_threads(threads, *plugin_classes):
+    """
+    Renders the plugin_classes in a pool of threads sharing the database
+    connection of the test, which holds the uncommitted test data.
+    """
+    shared = connections['default']
+    shared.allow_thread_sharing = True
+    pool = ThreadPool(threads, _share_connection, (shared,))
+    has_uncommitted_changes = plugin_rendering._has_uncommitted_changes
+    plugin_rendering._render_pool = (threads, pool)
+    plugin_rendering._has_uncommitted_changes = lambda: False
+    for plugin_class in plugin_classes:
+        plugin_class.thread_safe = True
+    try:
+        with SettingsOverride(CMS_PLUGIN_RENDER_THREADS=threads):
+            yield
+    finally:
+        for plugin_class in plugin_classes:
+            del plugin_class.thread_safe
+        plugin_rendering._has_uncommitted_changes = has_uncommitted_changes
+        plugin_rendering._render_pool = None
+        pool.terminate()
+        shared.allow_thread_sharing = False
+
+
 class RenderingTestCase(SettingsOverrideTestCase):
     settings_overrides = {
         'CMS_TEMPLATES': [(TEMPLATE_NAME, TEMPLATE_NAME), ('extra_context.html', 'extra_context.html')],
@@ -179,6 +219,87 @@ class RenderingTestCase(SettingsOverrideTestCase):
                                     'text_main'] + '|main|original_context_var_ok')
             plugin_rendering._standard_processors = {}
 
+    def test_standard_processors_cache(self):
+        """
+        Tests that the processors configured in settings are only imported once
+        and reloaded when the setting changes.
+        """
+        with SettingsOverride(CMS_PLUGIN_PROCESSORS=('cms.tests.rendering.sample_plugin_processor',)):
+            processors = plugin_rendering.get_standard_processors('PLUGIN_PROCESSORS')
+            self.assertEqual(processors, (sample_plugin_processor,))
+            self.assertTrue(plugin_rendering.get_standard_processors('PLUGIN_PROCESSORS') is processors)
+        self.assertEqual(plugin_rendering.get_standard_processors('PLUGIN_PROCESSORS'), ())
+
+    def test_render_plugins_concurrently(self):
+        """
+        Tests that rendering plugins in threads gives the same output and
+        sekizai data as rendering them one after the other.
+        """
+        placeholder = self.test_placeholders['sub']
+        for title in ('first', 'second', 'third'):
+            add_plugin(placeholder, 'GoogleMapPlugin', 'en', title=title, address="Riedtlistrasse 16",
+                       zipcode="8006", city="Zurich")
+        plugins = list(GoogleMap.objects.filter(placeholder=placeholder).order_by('position'))
+
+        def render():
+            context = self.get_context(self.test_page)
+            content = render_plugins(plugins, context, placeholder)
+            return content, list(context[get_varname()]['js'])
+
+        expected = render()
+        with render_in_threads(2, GoogleMapPlugin):
+            self.assertEqual(render(), expected)
+        self.assertEqual(len(expected[0]), 3)
+        self.assertTrue('first' in expected[0][0])
+        self.assertTrue('third' in expected[0][2])
+
+    def test_render_nested_plugins_concurrently(self):
+        """
+        Tests that the plugins rendered by a plugin rendered in a thread, here
+        the plugins of a stack, don't wait for a thread of the pool.
+        """
+        stack = Stack.objects.create(name='stack', code='stack')
+        add_plugin(stack.content, 'TextPlugin', 'en', body='first stacked')
+        add_plugin(stack.content, 'TextPlugin', 'en', body='second stacked')
+        placeholder = self.test_placeholders['sub']
+        add_plugin(placeholder, 'StackPlugin', 'en', stack=stack)
+        add_plugin(placeholder, 'TextPlugin', 'en', body='after the stack')
+        with render_in_threads(1, StackPlugin, TextPlugin):
+            content = render_placeholder(placeholder, self.get_context(self.test_page))
+        self.assertTrue(content.index('first stacked') < content.index('second stacked') <
+                        content.index('after the stack'))
+
+    def test_plugin_profiler(self):
+        """
+        Tests that rendered plugins are profiled if CMS_PLUGIN_PROFILER is enabled.
+        """
+        received = []
+
+        def receiver(sender, instance, profile, request, **kwargs):
+            received.append((sender, instance, profile, request))
+
+        plugin_rendered.connect(receiver)
+        try:
+            t = u'{% load cms_tags %}|{% placeholder "main" %}'
+            self.render(t, self.test_page)
+            self.assertEqual(received, [])
+            with SettingsOverride(CMS_PLUGIN_PROFILER=True):
+                context = self.get_context(self.test_page)
+                Template(t).render(context)
+        finally:
+            plugin_rendered.disconnect(receiver)
+        self.assertEqual(len(received), 1)
+        sender, instance, profile, request = received[0]
+        self.assertEqual(sender.__name__, 'TextPlugin')
+        self.assertEqual(profile.plugin_type, 'TextPlugin')
+        self.assertEqual(profile.plugin_id, instance.pk)
+        self.assertTrue(profile.wall_time >= profile.template_time >= 0)
+        self.assertTrue(request is context['request'])
+        self.assertEqual(get_plugin_profiles(request), [profile])
+        summary = summarize_plugin_profiles([profile, profile])
+        self.assertEqual(summary[0]['plugin_type'], 'TextPlugin')
+        self.assertEqual(summary[0]['count'], 2)
+
     def test_placeholder(self):
         """
         Tests the {% placeholder %} templatetag.
@@ -196,6 +317,74 @@ class RenderingTestCase(SettingsOverrideTestCase):
             r = self.render(t, self.test_page4)
         self.assertEqual(r, self.test_data4['extra'])
 
+    def test_placeholder_cache(self):
+        """
+        Tests that rendered placeholders are cached for anonymous users and
+        invalidated when a plugin in the placeholder is saved.
+        """
+        t = u'{% load cms_tags %}|{% placeholder "main" %}'
+        with SettingsOverride(CMS_PLACEHOLDER_CACHE=True,
+                              CMS_CACHE_DURATIONS={'menus': 0, 'content': 60, 'permissions': 0}):
+            r = self.render(t, self.reload(self.test_page))
+            self.assertEqual(r, u'|' + self.test_data['text_main'])
+            plugin = CMSPlugin.objects.filter(placeholder__page=self.test_page, placeholder__slot='main')[0]
+            instance = plugin.get_plugin_instance()[0]
+            # updating the table directly does not invalidate the cache
+            instance.__class__.objects.filter(pk=instance.pk).update(body=u'changed')
+            r = self.render(t, self.reload(self.test_page))
+            self.assertEqual(r, u'|' + self.test_data['text_main'])
+            instance = self.reload(instance)
+            instance.save()
+            r = self.render(t, self.reload(self.test_page))
+            self.assertEqual(r, u'|changed')
+
+    def test_cached_placeholder(self):
+        """
+        Tests that the {% cached_placeholder %} templatetag caches the content
+        of the placeholder until the page is published again.
+        """
+        t = u'{% load cms_tags %}|{% cached_placeholder "main" %}' + \
+            u'|{% cached_placeholder "empty" or %}No content{% endcached_placeholder %}'
+        with SettingsOverride(CMS_CACHE_DURATIONS={'menus': 0, 'content': 60, 'permissions': 0}):
+            r = self.render(t, self.reload(self.test_page))
+            self.assertEqual(r, u'|' + self.test_data['text_main'] + u'|No content')
+            draft = self.test_page.get_draft_object()
+            plugin = CMSPlugin.objects.filter(placeholder__page=draft, placeholder__slot='main')[0]
+            instance = plugin.get_plugin_instance()[0]
+            instance.body = u'changed'
+            instance.save()
+            r = self.render(t, self.reload(self.test_page))
+            self.assertEqual(r, u'|' + self.test_data['text_main'] + u'|No content')
+            self.reload(draft).publish()
+            r = self.render(t, self.reload(self.test_page))
+            self.assertEqual(r, u'|changed|No content')
+
+    def test_cached_placeholder_sekizai(self):
+        """
+        Tests that the data the plugins added to sekizai blocks is added again
+        when the content of a {% cached_placeholder %} comes from the cache,
+        and that nothing is cached for authenticated users.
+        """
+        add_plugin(self.test_placeholders['sub'], 'GoogleMapPlugin', 'en', title='map',
+                   address="Riedtlistrasse 16", zipcode="8006", city="Zurich")
+        self.reload(self.test_page.get_draft_object()).publish()
+        t = u'{% load cms_tags sekizai_tags %}|{% cached_placeholder "sub" %}|{% render_block "js" %}'
+        with SettingsOverride(CMS_CACHE_DURATIONS={'menus': 0, 'content': 60, 'permissions': 0}):
+            expected = self.render(t, self.reload(self.test_page))
+            self.assertTrue('maps/api/js' in expected)
+            self.assertEqual(self.render(t, self.reload(self.test_page)), expected)
+            plugin = CMSPlugin.objects.filter(placeholder__page=self.test_page, placeholder__slot='sub',
+                                              plugin_type='TextPlugin')[0]
+            instance = plugin.get_plugin_instance()[0]
+            instance.body = u'changed'
+            instance.save()
+            self.assertEqual(self.render(t, self.reload(self.test_page)), expected)
+            context = self.get_context(self.reload(self.test_page))
+            context['request'].user = self.test_user
+            r = self.strip_rendered(Template(t).render(context))
+            self.assertTrue(u'changed' in r)
+            self.assertTrue('maps/api/js' in r)
+
     def test_placeholder_or(self):
         """
         Tests the {% placeholder %} templatetag.
@@ -303,6 +492,33 @@ class RenderingTestCase(SettingsOverrideTestCase):
         r = self.render(t, self.test_page3)
         self.assertEqual(r, u'|' + self.test_data['text_main'] + '|' + self.test_data3['text_sub'])
 
+    def test_inherit_placeholder_queries(self):
+        """
+        Tests that the number of queries needed to inherit a placeholder does
+        not depend on the depth of the page.
+        """
+        # neither page has plugins of its own, so they only differ in depth
+        draft4 = create_page('RenderingTestCase-title5', TEMPLATE_NAME, 'en',
+                             parent=self.test_page3.get_draft_object(), published=True)
+        draft5 = create_page('RenderingTestCase-title6', TEMPLATE_NAME, 'en',
+                             parent=draft4, published=True)
+        test_page4 = self.reload(draft4.get_public_object())
+        test_page5 = self.reload(draft5.get_public_object())
+        t = u'{% load cms_tags %}|{% placeholder "main" inherit %}'
+
+        def render(page):
+            with SettingsOverride(DEBUG=True):
+                start = len(connection.queries)
+                r = self.render(t, self.reload(page))
+                return r, len(connection.queries) - start
+
+        render(test_page4)
+        r4, queries4 = render(test_page4)
+        r5, queries5 = render(test_page5)
+        self.assertEqual(r4, u'|' + self.test_data['text_main'])
+        self.assertEqual(r5, u'|' + self.test_data['text_main'])
+        self.assertEqual(queries4, queries5)
+
     def test_extra_context_isolation(self):
         with ChangeModel(self.test_page, template='extra_context.html'):
             response = self.client.get(self.test_page.get_absolute_url())
@@ -3,13 +3,15 @@ import sys
 import re
 
 from django.contrib.auth.models import Permission
-from cms.api import create_page
+from cms.api import create_page, add_plugin
 from cms.apphook_pool import apphook_pool
-from cms.models import PagePermission
+from cms.models import PagePermission, Title
 from cms.test_utils.testcases import SettingsOverrideTestCase
 from cms.test_utils.util.context_managers import SettingsOverride
 from cms.views import _handle_no_page, details
 from django.conf import settings
+from django.contrib import messages
+from django.contrib.messages.storage import default_storage
 from django.core.urlresolvers import clear_url_caches
 from django.http import Http404
 
@@ -128,6 +130,101 @@ class ViewTests(SettingsOverrideTestCase):
             self.assertEqual(response.status_code, 302)
             self.assertTrue(login_rx.search(response['Location']))
 
+    def test_page_cache(self):
+        page = create_page("cached page", "nav_playground.html", "en", published=True)
+        public = page.publisher_public
+        with SettingsOverride(CMS_PAGE_CACHE=True,
+                              CMS_CACHE_DURATIONS={'menus': 0, 'content': 60, 'permissions': 0}):
+            response = self.client.get(public.get_absolute_url())
+            self.assertContains(response, "cached page")
+            # updating the table directly does not invalidate the cache
+            Title.objects.filter(page=public).update(title="changed page")
+            response = self.client.get(public.get_absolute_url())
+            self.assertContains(response, "cached page")
+            # but publishing does
+            title = page.title_set.get(language="en")
+            title.title = "published page"
+            title.save()
+            page.publish()
+            response = self.client.get(public.get_absolute_url())
+            self.assertContains(response, "published page")
+            # logged in users never get a cached response
+            Title.objects.filter(page=public).update(title="changed page")
+            user = self.get_superuser()
+            self.client.login(username=user.username, password=user.username)
+            response = self.client.get(public.get_absolute_url())
+            self.assertContains(response, "changed page")
+
+    def test_page_cache_csrf_token(self):
+        """
+        Pages using a CSRF token are user specific and must not be cached.
+        """
+        templates = (('nav_playground.html', 'nav_playground.html'), ('csrf_token.html', 'csrf_token.html'))
+        with SettingsOverride(CMS_TEMPLATES=templates, CMS_PAGE_CACHE=True,
+                              CMS_CACHE_DURATIONS={'menus': 0, 'content': 60, 'permissions': 0}):
+            page = create_page("csrf page", "csrf_token.html", "en", published=True)
+            public = page.publisher_public
+            response = self.client.get(public.get_absolute_url())
+            self.assertContains(response, "csrfmiddlewaretoken")
+            self.assertContains(response, "csrf page")
+            Title.objects.filter(page=public).update(title="changed page")
+            response = self.client.get(public.get_absolute_url())
+            self.assertContains(response, "changed page")
+
+    def test_page_cache_messages(self):
+        """
+        Messages are only shown once, pages showing them must not be cached.
+        """
+        templates = (('nav_playground.html', 'nav_playground.html'), ('messages.html', 'messages.html'))
+        with SettingsOverride(CMS_TEMPLATES=templates, CMS_PAGE_CACHE=True,
+                              CMS_CACHE_DURATIONS={'menus': 0, 'content': 60, 'permissions': 0}):
+            page = create_page("messages page", "messages.html", "en", published=True)
+            public = page.publisher_public
+            request = self.get_request(public.get_absolute_url())
+            request._messages = default_storage(request)
+            messages.info(request, "one time message")
+            response = details(request, public.get_path())
+            response.render()
+            self.assertContains(response, "one time message")
+            response = self.client.get(public.get_absolute_url())
+            self.assertContains(response, "messages page")
+            self.assertNotContains(response, "one time message")
+
+    def test_page_streaming(self):
+        templates = (('nav_playground.html', 'nav_playground.html'), ('streaming.html', 'streaming.html'))
+        with SettingsOverride(CMS_TEMPLATES=templates):
+            page = create_page("streamed page", "streaming.html", "en", published=True)
+            for slot in ('first', 'second'):
+                add_plugin(page.placeholders.get(slot=slot), 'TextPlugin', 'en', body='%s content' % slot)
+            page.publish()
+            url = page.get_absolute_url()
+            expected = self.client.get(url).content
+            with SettingsOverride(CMS_PAGE_STREAMING=True):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(hasattr(response, 'render'))
+                chunks = list(response)
+            self.assertEqual(b''.join(chunks), expected)
+            # every placeholder is sent as soon as it is rendered
+            first = [chunk for chunk in chunks if b'first content' in chunk]
+            second = [chunk for chunk in chunks if b'second content' in chunk]
+            self.assertEqual(len(first), 1)
+            self.assertEqual(len(second), 1)
+            self.assertTrue(chunks.index(first[0]) < chunks.index(second[0]))
+
+    def test_page_streaming_render_block(self):
+        """
+        Templates with a render_block before the placeholders aren't streamed.
+        """
+        page = create_page("buffered page", "nav_playground.html", "en", published=True)
+        url = page.get_absolute_url()
+        expected = self.client.get(url).content
+        with SettingsOverride(CMS_PAGE_STREAMING=True):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(hasattr(response, 'render'))
+            self.assertEqual(response.content, expected)
+
     def test_edit_permission(self):
         page = create_page("page", "nav_playground.html", "en", published=True)
 
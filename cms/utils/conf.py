@@ -38,6 +38,13 @@ DEFAULTS = {
     'RAW_ID_USERS': False,
     'PUBLIC_FOR': 'all',
     'CONTENT_CACHE_DURATION': 60,
+    'PLACEHOLDER_CACHE': False,
+    'PAGE_CACHE': False,
+    'PAGE_CACHE_VARY_HEADERS': (),
+    'MENU_OUTPUT_CACHE': False,
+    'PAGE_STREAMING': False,
+    'PLUGIN_RENDER_THREADS': 0,
+    'PLUGIN_PROFILER': False,
     'APPHOOKS': [],
     'TOOLBARS': [],
     'SITE_CHOICES_CACHE_KEY': 'CMS:site_choices',
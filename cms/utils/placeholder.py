@@ -6,6 +6,8 @@ from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from cms.utils.compat.dj import force_unicode
 from django.db.models.query_utils import Q
+from django.utils.translation import get_language
+from sekizai.helpers import get_varname
 
 
 def get_toolbar_plugin_struct(plugins_list, slot, page, parent=None):
@@ -21,10 +23,26 @@ def get_toolbar_plugin_struct(plugins_list, slot, page, parent=None):
     :param page: the page
     :param parent: parent plugin class, if any
     :return: list of dictionaries
+
+    The lists are memoized per slot, template, parent and language until the
+    plugin pool or CMS_PLACEHOLDER_CONF change.
     """
+    from cms.plugin_pool import plugin_pool
+
     template = None
     if page:
         template = page.template
+    # the names of the plugins might be translated
+    cache_key = ('get_toolbar_plugin_struct', tuple(plugin.value for plugin in plugins_list), slot, template,
+                 parent.__name__ if parent else None, get_language())
+    cache = plugin_pool.get_cache()
+    if cache_key not in cache:
+        cache[cache_key] = tuple(tuple(item.items()) for item in
+                                 _get_toolbar_plugin_struct(plugins_list, slot, page, template, parent))
+    return [dict(item) for item in cache[cache_key]]
+
+
+def _get_toolbar_plugin_struct(plugins_list, slot, page, template, parent):
     main_list = []
     for plugin in plugins_list:
         if parent:
@@ -42,6 +60,25 @@ def get_toolbar_plugin_struct(plugins_list, slot, page, parent=None):
     return sorted(main_list, key=operator.itemgetter("module"))
 
 
+# the CMS_PLACEHOLDER_CONF the index has been compiled from, the values of its
+# settings by (placeholder conf key, setting) and the resolved values by
+# (template, placeholder, setting)
+_placeholder_conf_index = (None, {}, {})
+
+
+def _get_placeholder_conf_index():
+    global _placeholder_conf_index
+    placeholder_conf = get_cms_setting('PLACEHOLDER_CONF')
+    if _placeholder_conf_index[0] is not placeholder_conf:
+        values = {}
+        for key, conf in placeholder_conf.items():
+            for setting, value in (conf or {}).items():
+                if value:
+                    values[(key, setting)] = value
+        _placeholder_conf_index = (placeholder_conf, values, {})
+    return _placeholder_conf_index
+
+
 def get_placeholder_conf(setting, placeholder, template=None, default=None):
     """
     Returns the placeholder configuration for a given setting. The key would for
@@ -51,20 +88,49 @@ def get_placeholder_conf(setting, placeholder, template=None, default=None):
     CMS_PLACEHOLDER_CONF['template placeholder'] and
     CMS_PLACEHOLDER_CONF['placeholder'], if no template is given only the latter
     is checked.
+
+    CMS_PLACEHOLDER_CONF is compiled into an index the first time it is used
+    and whenever it is replaced, and resolved values are kept in it.
     """
-    if placeholder:
-        keys = []
+    if not placeholder:
+        return default
+    placeholder = force_unicode(placeholder)
+    placeholder_conf, values, resolved = _get_placeholder_conf_index()
+    resolved_key = (template, placeholder, setting)
+    if resolved_key not in resolved:
+        value = None
         if template:
-            keys.append("%s %s" % (template, placeholder))
-        keys.append(placeholder)
-        for key in keys:
-            conf = get_cms_setting('PLACEHOLDER_CONF').get(key)
-            if not conf:
-                continue
-            value = conf.get(setting)
-            if value:
-                return value
-    return default
+            value = values.get(("%s %s" % (template, placeholder), setting))
+        if value is None:
+            value = values.get((placeholder, setting))
+        resolved[resolved_key] = value
+    value = resolved[resolved_key]
+    if value is None:
+        return default
+    return value
+
+
+def warm_placeholder_conf_index():
+    """
+    Compiles CMS_PLACEHOLDER_CONF into the index used by get_placeholder_conf,
+    eg at startup.
+    """
+    _get_placeholder_conf_index()
+
+
+def restore_sekizai(context, changes):
+    """
+    Replays sekizai changes (as returned by sekizai.helpers.Watcher) on the
+    given context, eg when content is served from the cache.
+    """
+    varname = get_varname()
+    if varname not in context:
+        return
+    sekizai_container = context[varname]
+    for key, values in changes.items():
+        sekizai_namespace = sekizai_container[key]
+        for value in values:
+            sekizai_namespace.append(value)
 
 
 def get_page_from_placeholder_if_exists(placeholder):
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
+from cms.constants import TEMPLATE_INHERITANCE_MAGIC
 from cms.exceptions import DuplicatePlaceholderWarning
 from cms.models import Page
 from cms.templatetags.cms_tags import Placeholder
+from cms.utils import get_cms_setting
 from cms.utils.placeholder import validate_placeholder_name
 from django.contrib.sites.models import Site, SITE_CACHE
 from django.shortcuts import get_object_or_404
 from django.template import NodeList, VariableNode, TemplateSyntaxError
+from django.template import loader as template_loader
 from django.template.loader import get_template
 from django.template.loader_tags import ConstantIncludeNode, ExtendsNode, BlockNode
+from django.test.signals import setting_changed
+import os
 import warnings
 from sekizai.helpers import is_variable_extend_node
 
@@ -123,20 +128,122 @@ def _scan_placeholders(nodelist, current_block=None, ignore_blocks=None):
     return placeholders
 
 
+# template name -> (dependencies, placeholders, duplicates), see get_placeholders
+_placeholders_cache = {}
+
+
+def _get_source_loaders():
+    """
+    Returns the template loaders in use, the ones wrapped by the cached loader
+    included.
+    """
+    loaders = []
+    for loader in template_loader.template_source_loaders or ():
+        loaders.extend(getattr(loader, 'loaders', [loader]))
+    return loaders
+
+
+def _get_template_source(name):
+    """
+    Returns the path and modification time of the file a template is loaded
+    from, or None if the loaders don't tell (eg the eggs loader).
+    """
+    for loader in _get_source_loaders():
+        get_template_sources = getattr(loader, 'get_template_sources', None)
+        if get_template_sources is None:
+            continue
+        for path in get_template_sources(name):
+            try:
+                return path, os.path.getmtime(path)
+            except (OSError, ValueError):
+                continue
+    return None
+
+
+def _get_template_names(compiled_template):
+    """
+    Returns the names of a template and of all templates it extends or
+    includes.
+    """
+    names = [compiled_template.name]
+    for node in compiled_template.nodelist.get_nodes_by_type(ExtendsNode):
+        if not is_variable_extend_node(node):
+            names += _get_template_names(node.get_parent({}))
+    for node in compiled_template.nodelist.get_nodes_by_type(ConstantIncludeNode):
+        if node.template:
+            names += _get_template_names(node.template)
+    return names
+
+
+def _get_cached_template_loaders():
+    return [loader for loader in template_loader.template_source_loaders or ()
+            if hasattr(loader, 'template_cache')]
+
+
+def _is_valid(template, dependencies):
+    cached_loaders = _get_cached_template_loaders()
+    for loader in cached_loaders:
+        # the cached loader has been reset
+        if template not in loader.template_cache:
+            return False
+    # the cached loader keeps returning the templates it has compiled until it
+    # is reset, so there is no point in stat()ing their files. Without it,
+    # templates are read from disk whenever they are rendered and checking
+    # their modification times is cheap in comparison
+    if cached_loaders:
+        return True
+    for name, source in dependencies:
+        if _get_template_source(name) != source:
+            return False
+    return True
+
+
 def get_placeholders(template):
-    compiled_template = get_template(template)
-    placeholders = _scan_placeholders(compiled_template.nodelist)
-    clean_placeholders = []
-    for placeholder in placeholders:
-        if placeholder in clean_placeholders:
-            warnings.warn("Duplicate {{% placeholder \"{0}\" %}} "
-                          "in template {1}."
-                          .format(placeholder, template, placeholder),
-                          DuplicatePlaceholderWarning)
-        else:
-            validate_placeholder_name(placeholder)
-            clean_placeholders.append(placeholder)
-    return clean_placeholders
+    """
+    Returns the names of the placeholders in a template.
+
+    The result is cached per template name until the source of the template or
+    of one of the templates it extends or includes is modified, or a setting
+    changes. With the cached template loader, it is kept until the loader is
+    reset instead, like the compiled templates themselves.
+    """
+    cached = _placeholders_cache.get(template, None)
+    if cached is None or not _is_valid(template, cached[0]):
+        compiled_template = get_template(template)
+        placeholders = _scan_placeholders(compiled_template.nodelist)
+        clean_placeholders = []
+        duplicates = []
+        for placeholder in placeholders:
+            if placeholder in clean_placeholders:
+                duplicates.append(placeholder)
+            else:
+                validate_placeholder_name(placeholder)
+                clean_placeholders.append(placeholder)
+        dependencies = [(name, _get_template_source(name))
+                        for name in set(_get_template_names(compiled_template))]
+        cached = (dependencies, tuple(clean_placeholders), tuple(duplicates))
+        _placeholders_cache[template] = cached
+    for placeholder in cached[2]:
+        warnings.warn("Duplicate {{% placeholder \"{0}\" %}} "
+                      "in template {1}."
+                      .format(placeholder, template, placeholder),
+                      DuplicatePlaceholderWarning)
+    return list(cached[1])
+
+
+def clear_placeholders_cache(**kwargs):
+    _placeholders_cache.clear()
+
+setting_changed.connect(clear_placeholders_cache, dispatch_uid='cms.utils.plugins.clear_placeholders_cache')
+
+
+def warm_placeholders_cache():
+    """
+    Scans all templates in CMS_TEMPLATES for placeholders, eg at startup.
+    """
+    for template, name in get_cms_setting('TEMPLATES'):
+        if template != TEMPLATE_INHERITANCE_MAGIC:
+            get_placeholders(template)
 
 
 SITE_VAR = "site__exact"
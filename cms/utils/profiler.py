@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Records how long plugins take to render and how many queries they run, if
+CMS_PLUGIN_PROFILER is enabled.
+
+For every rendered plugin instance a PluginProfile is sent with the
+plugin_rendered signal, logged to the 'cms.plugins.profiler' logger and, if
+the plugin is rendered for a request, added to the request (see
+get_plugin_profiles). Timings and query counts of plugins include the ones of
+their child plugins.
+"""
+from logging import getLogger
+import threading
+import time
+
+from django.db import connections
+from django.dispatch import Signal
+from django.template.loader import render_to_string
+from django.utils.translation import ugettext_lazy as _
+
+log = getLogger('cms.plugins.profiler')
+
+# sent after a plugin instance has been rendered, the sender is the plugin class
+plugin_rendered = Signal(providing_args=["instance", "profile", "request"])
+
+_local = threading.local()
+
+
+class PluginProfile(object):
+    def __init__(self, instance):
+        self.plugin_type = instance.plugin_type
+        self.plugin_id = instance.pk
+        self.placeholder_id = instance.placeholder_id
+        # all times are in seconds
+        self.wall_time = 0
+        self.template_time = 0
+        self.queries = 0
+
+    def as_dict(self):
+        return {
+            'plugin_type': self.plugin_type,
+            'plugin_id': self.plugin_id,
+            'placeholder_id': self.placeholder_id,
+            'wall_time': self.wall_time,
+            'template_time': self.template_time,
+            'queries': self.queries,
+        }
+
+
+def _get_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def get_current_profile():
+    """
+    Returns the profile of the plugin being rendered in this thread or None.
+    """
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def start_plugin_profile(instance):
+    profile = PluginProfile(instance)
+    # make sure queries are logged, even if DEBUG is False
+    profile._connections = [(connection, connection.use_debug_cursor, len(connection.queries))
+                            for connection in connections.all()]
+    for connection in connections.all():
+        connection.use_debug_cursor = True
+    profile._start = time.time()
+    _get_stack().append(profile)
+    return profile
+
+
+def finish_plugin_profile(profile, plugin, instance, context):
+    profile.wall_time = time.time() - profile._start
+    _get_stack().pop()
+    for connection, use_debug_cursor, queries in profile._connections:
+        profile.queries += len(connection.queries) - queries
+        connection.use_debug_cursor = use_debug_cursor
+    del profile._connections, profile._start
+    request = context.get('request', None) if context is not None else None
+    if request is not None:
+        if not hasattr(request, '_cms_plugin_profiles'):
+            request._cms_plugin_profiles = []
+        request._cms_plugin_profiles.append(profile)
+    log.debug("Rendered %s plugin %s in %.1fms (template %.1fms), %d queries",
+              profile.plugin_type, profile.plugin_id, profile.wall_time * 1000,
+              profile.template_time * 1000, profile.queries, extra=profile.as_dict())
+    plugin_rendered.send(sender=plugin.__class__, instance=instance, profile=profile, request=request)
+
+
+def get_plugin_profiles(request):
+    """
+    Returns the profiles of the plugins rendered for a request, in the order
+    they have been rendered.
+    """
+    return getattr(request, '_cms_plugin_profiles', [])
+
+
+def summarize_plugin_profiles(profiles):
+    """
+    Returns the number of instances, wall time, template time and queries per
+    plugin type, slowest plugin type first.
+    """
+    summary = {}
+    for profile in profiles:
+        if profile.plugin_type not in summary:
+            summary[profile.plugin_type] = {'plugin_type': profile.plugin_type, 'count': 0,
+                                            'wall_time': 0, 'template_time': 0, 'queries': 0}
+        totals = summary[profile.plugin_type]
+        totals['count'] += 1
+        totals['wall_time'] += profile.wall_time
+        totals['template_time'] += profile.template_time
+        totals['queries'] += profile.queries
+    return sorted(summary.values(), key=lambda totals: totals['wall_time'], reverse=True)
+
+
+try:
+    from debug_toolbar.panels import DebugPanel
+except ImportError:
+    DebugPanel = None
+
+if DebugPanel is not None:
+    class PluginProfilerPanel(DebugPanel):
+        """
+        A django-debug-toolbar panel listing the rendered plugins, add
+        'cms.utils.profiler.PluginProfilerPanel' to DEBUG_TOOLBAR_PANELS.
+        """
+        name = 'CMSPluginProfiler'
+        template = 'cms/debug_toolbar/plugin_profiler.html'
+        has_content = True
+
+        def nav_title(self):
+            return _('CMS plugins')
+
+        def nav_subtitle(self):
+            profiles = getattr(self, '_profiles', [])
+            return '%d plugins' % len(profiles)
+
+        def title(self):
+            return _('CMS plugin rendering')
+
+        def url(self):
+            return ''
+
+        def process_response(self, request, response):
+            self._profiles = get_plugin_profiles(request)
+            self._summary = summarize_plugin_profiles(self._profiles)
+            if hasattr(self, 'record_stats'):
+                self.record_stats({'profiles': self._profiles, 'plugin_types': self._summary})
+
+        def content(self):
+            return render_to_string(self.template, {
+                'profiles': getattr(self, '_profiles', []),
+                'plugin_types': getattr(self, '_summary', []),
+            })
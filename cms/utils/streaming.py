@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from cms.utils.compat.dj import force_unicode
+from django.template.base import TextNode
+from django.template.loader import get_template
+from django.template.loader_tags import BlockNode, ExtendsNode, BlockContext, BLOCK_CONTEXT_KEY
+from sekizai.templatetags.sekizai_tags import RenderBlock
+
+
+def _get_extends_node(nodelist):
+    for node in nodelist:
+        if isinstance(node, ExtendsNode):
+            return node
+        if not isinstance(node, TextNode):
+            return None
+    return None
+
+
+def _get_root_nodelist(template, context):
+    """
+    Follows the {% extends %} chain of the template the way ExtendsNode.render
+    does and returns the nodelist of the template at the top of the chain.
+    """
+    nodelist = template.nodelist
+    extends = _get_extends_node(nodelist)
+    while extends is not None:
+        parent = extends.get_parent(context)
+        if BLOCK_CONTEXT_KEY not in context.render_context:
+            context.render_context[BLOCK_CONTEXT_KEY] = BlockContext()
+        block_context = context.render_context[BLOCK_CONTEXT_KEY]
+        block_context.add_blocks(extends.blocks)
+        nodelist = parent.nodelist
+        extends = _get_extends_node(nodelist)
+        if extends is None:
+            block_context.add_blocks(dict((node.name, node) for node in nodelist.get_nodes_by_type(BlockNode)))
+    return nodelist
+
+
+def _iter_block(node, context):
+    """
+    Renders a {% block %} node like BlockNode.render does, but yields the
+    output of its child nodes one by one.
+    """
+    block_context = context.render_context.get(BLOCK_CONTEXT_KEY)
+    context.push()
+    push = None
+    if block_context is None:
+        context['block'] = node
+        nodelist = node.nodelist
+    else:
+        push = block = block_context.pop(node.name)
+        if block is None:
+            block = node
+        # create a new block so we can store the context without thread-safety issues
+        block = BlockNode(block.name, block.nodelist)
+        block.context = context
+        context['block'] = block
+        nodelist = block.nodelist
+    for chunk in _iter_nodelist(nodelist, context):
+        yield chunk
+    if push is not None:
+        block_context.push(node.name, push)
+    context.pop()
+
+
+def _iter_nodelist(nodelist, context):
+    for node in nodelist:
+        if isinstance(node, BlockNode):
+            for chunk in _iter_block(node, context):
+                yield chunk
+        else:
+            yield force_unicode(nodelist.render_node(node, context))
+
+
+def _buffers_content(nodelist, context):
+    """
+    Returns True if a sekizai {% render_block %} in the nodelist or in one of
+    its blocks is followed by a block or a placeholder. render_block can only
+    output the data added to it once everything after it is rendered, so all of
+    that would be rendered in one piece.
+    """
+    from cms.templatetags.cms_tags import Placeholder
+
+    block_context = context.render_context.get(BLOCK_CONTEXT_KEY)
+    for node in nodelist:
+        if isinstance(node, RenderBlock):
+            if node.nodelist.get_nodes_by_type(BlockNode) or node.nodelist.get_nodes_by_type(Placeholder):
+                return True
+        elif isinstance(node, BlockNode):
+            block = block_context.get_block(node.name) if block_context is not None else None
+            if _buffers_content((block or node).nodelist, context):
+                return True
+    return False
+
+
+def _iter_template(nodelist, context):
+    try:
+        for chunk in _iter_nodelist(nodelist, context):
+            yield chunk
+    finally:
+        context.render_context.pop()
+
+
+def stream_template(template_name, context):
+    """
+    Returns an iterator rendering the template and yielding its output in
+    chunks as soon as they are rendered: each node of the base template and
+    each node inside of {% block %} tags is a chunk.
+
+    Sekizai's {% render_block %} can only output the data added to it once
+    everything after it is rendered. Returns None if a render_block tag comes
+    before a block or a placeholder (eg the "css" block in the <head>), since
+    nothing but the part before it could be streamed. A render_block at the
+    end of the page, like the "js" block, is rendered as the last chunk.
+    """
+    template = get_template(template_name)
+    context.render_context.push()
+    nodelist = _get_root_nodelist(template, context)
+    if _buffers_content(nodelist, context):
+        context.render_context.pop()
+        return None
+    return _iter_template(nodelist, context)
@@ -3,18 +3,25 @@ from __future__ import with_statement
 from django.contrib.auth.views import redirect_to_login
 from django.template.response import TemplateResponse
 from cms.apphook_pool import apphook_pool
+from cms.cache.page import get_page_cache, set_page_cache
 from cms.appresolver import get_app_urls
 from cms.models import Title
-from cms.utils import get_template_from_request, get_language_from_request
+from cms.utils import get_template_from_request, get_language_from_request, get_cms_setting
 from cms.utils.i18n import get_fallback_languages, force_language, get_public_languages, get_redirect_on_fallback, \
     get_language_list, is_language_prefix_patterns_used
 from cms.utils.page_resolver import get_page_from_request
+from cms.utils.streaming import stream_template
 from cms.test_utils.util.context_managers import SettingsOverride
 from django.conf import settings
 from django.conf.urls import patterns
 from django.core.urlresolvers import resolve, Resolver404, reverse
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:  # Django 1.4
+    StreamingHttpResponse = None
 from django.template.context import RequestContext
+from django.utils.cache import patch_vary_headers
 from django.utils.http import urlquote
 
 
@@ -24,11 +31,74 @@ def _handle_no_page(request, slug):
     raise Http404('CMS: Page not found for "%s"' % slug)
 
 
+def _use_page_cache(request):
+    """
+    Whole pages are only cached for anonymous GET requests without a query
+    string (which excludes the edit and preview modes).
+    """
+    if not get_cms_setting('PAGE_CACHE') or request.method not in ('GET', 'HEAD') or request.GET:
+        return False
+    if hasattr(request, 'user') and request.user.is_authenticated():
+        return False
+    session = getattr(request, 'session', None)
+    return not (session and session.get('cms_edit', False))
+
+
+def _is_user_specific(request, response):
+    """
+    The callback storing the response runs before the response middlewares set
+    the session and CSRF cookies, so the request is checked for what makes them
+    set one. Pages showing messages are left out too, they are only shown once.
+    """
+    if response.cookies or request.META.get('CSRF_COOKIE_USED', False):
+        return True
+    messages = getattr(request, '_messages', None)
+    if messages is not None and messages.used and len(messages):
+        return True
+    session = getattr(request, 'session', None)
+    return bool(session and session.modified)
+
+
+def _set_page_cache(request, site_id, language, path):
+    def callback(response):
+        if request.method == 'GET' and response.status_code == 200 and not _is_user_specific(request, response):
+            set_page_cache(request, site_id, language, path, response)
+    return callback
+
+
+def _stream_page(request, template_name, context, language):
+    """
+    Returns a response streaming the page or None if the template can't be
+    streamed, see stream_template.
+    """
+    stream = stream_template(template_name, context)
+    if stream is None:
+        return None
+
+    def content():
+        # the content is rendered after the view returned
+        with force_language(language):
+            for chunk in stream:
+                yield chunk
+    if StreamingHttpResponse is not None:
+        return StreamingHttpResponse(content())
+    return HttpResponse(content())
+
+
 def details(request, slug):
     """
     The main view of the Django-CMS! Takes a request and a slug, renders the
     page.
     """
+    use_cache = _use_page_cache(request)
+    if use_cache:
+        # the response is stored under the same language and path
+        cache_language = get_language_from_request(request)
+        cached = get_page_cache(request, settings.SITE_ID, cache_language, slug)
+        if cached is not None:
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+            patch_vary_headers(response, get_cms_setting('PAGE_CACHE_VARY_HEADERS'))
+            return response
     # get the right model
     context = RequestContext(request)
     # Get a Page model object from the request
@@ -145,4 +215,12 @@ def details(request, slug):
     if not context['has_view_permissions']:
         return _handle_no_page(request, slug)
 
-    return TemplateResponse(request, template_name, context)
+    if get_cms_setting('PAGE_STREAMING') and not use_cache:
+        response = _stream_page(request, template_name, context, current_language)
+        if response is not None:
+            return response
+    response = TemplateResponse(request, template_name, context)
+    if use_cache:
+        response.add_post_render_callback(_set_page_cache(request, settings.SITE_ID, cache_language, slug))
+        patch_vary_headers(response, get_cms_setting('PAGE_CACHE_VARY_HEADERS'))
+    return response
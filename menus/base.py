@@ -15,6 +15,17 @@ class Menu(object):
         should return a list of NavigationNode instances
         """ 
         raise NotImplementedError
+
+    def get_cache_vary(self, request):
+        """
+        The nodes of a menu are cached per site and language. This should
+        return a value identifying everything else the nodes depend on, by
+        default the user. Menus whose nodes are the same for all users should
+        return None, so the nodes are cached only once.
+        """
+        if request.user.is_authenticated():
+            return request.user.pk
+        return None
     
 class Modifier(object):
     
@@ -22,6 +33,20 @@ class Modifier(object):
         pass
     
 class NavigationNode(object):
+    # the attributes every node has are slots, which keeps the nodes small.
+    # The attributes added by menus and modifiers are kept in extra, a
+    # dictionary that is only created for the nodes that get any
+    __slots__ = ('title', 'url', 'id', 'parent_id', 'parent_namespace', 'namespace', 'visible', 'attr',
+                 'children', 'parent', 'extra')
+
+    # the defaults of the attributes set by the menu pool and the Marker
+    # modifier
+    _extra_defaults = {
+        'selected': False,
+        'sibling': False,
+        'ancestor': False,
+        'descendant': False,
+    }
     
     def __init__(self, title, url, id, parent_id=None, parent_namespace=None, attr=None, visible=True):
         self.children = [] # do not touch
@@ -42,6 +67,44 @@ class NavigationNode(object):
     def __repr__(self):
         return "<Navigation Node: %s>" % smart_str(self.title)
     
+    def __getattr__(self, name):
+        # only called for the attributes that are not found on the node
+        if name != 'extra':
+            extra = getattr(self, 'extra', None)
+            if extra and name in extra:
+                return extra[name]
+            if name in self._extra_defaults:
+                return self._extra_defaults[name]
+        raise AttributeError("%r object has no attribute %r" % (self.__class__.__name__, name))
+
+    def __setattr__(self, name, value):
+        if name in _NODE_SLOTS or (name not in self._extra_defaults and hasattr(self.__class__, name)):
+            object.__setattr__(self, name, value)
+        else:
+            extra = getattr(self, 'extra', None)
+            if extra is None:
+                extra = {}
+                object.__setattr__(self, 'extra', extra)
+            extra[name] = value
+
+    def __delattr__(self, name):
+        extra = getattr(self, 'extra', None)
+        if extra and name in extra:
+            del extra[name]
+        else:
+            object.__delattr__(self, name)
+
+    def __getstate__(self):
+        state = dict(getattr(self, 'extra', None) or {})
+        for name in NavigationNode.__slots__[:-1]:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def get_menu_title(self):
         return self.title
     
@@ -63,4 +126,7 @@ class NavigationNode(object):
         if getattr(self, 'parent', None):
             nodes.append(self.parent)
             nodes += self.parent.get_ancestors()
-        return nodes
\ No newline at end of file
+        return nodes
+
+
+_NODE_SLOTS = frozenset(NavigationNode.__slots__)
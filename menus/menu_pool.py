@@ -1,68 +1,229 @@
 # -*- coding: utf-8 -*-
 from cms.utils import get_cms_setting
+from cms.utils.compat.dj import force_unicode
 from cms.utils.django_load import load
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.utils.translation import get_language
 from menus.exceptions import NamespaceAllreadyRegistered
-from menus.models import CacheKey
-import copy
+import hashlib
+import random
 
 def _build_nodes_inner_for_one_menu(nodes, menu_class_name):
     '''
     This is an easier to test "inner loop" building the menu tree structure
     for one menu (one language, one site) 
+
+    Nodes are linked to the parent with their parent_id in their namespace
+    (the menu class name if they have none). Nodes whose parent does not
+    exist, or that are part of a cycle, are dropped along with their
+    descendants. Node ids are expected to be unique per namespace, if they
+    are not, children are linked to the first node with the id.
+
+    The nodes are returned in the order they would have been accepted by
+    going through the list over and over again, accepting nodes whose parent
+    has been accepted before: in order of that round, then of their position
+    in the list. The round of a node is the one of its parent, or the next
+    one if it comes before its parent in the list. This takes linear time,
+    regardless of the order of the nodes.
     '''
-    done_nodes = {} # Dict of node.id:Node
-    final_nodes = []
-    
-    # This is to prevent infinite loops - we need to compare the number of 
-    # times we see a specific node to "something", and for the time being, 
-    # it's the total number of nodes
-    list_total_length = len(nodes)
-    
-    while nodes:
-        # For when the node has a parent_id but we haven't seen it yet. 
-        # We must not append it to the final list in this case!
-        should_add_to_final_list = True 
-        
-        node = nodes.pop(0)
-        
-        # Increment the "seen" counter for this specific node.
-        node._counter = getattr(node,'_counter',0) + 1  
-        
+    # (namespace, id) -> index of the first node with the id
+    indexes = {}
+    for index, node in enumerate(nodes):
         # Implicit namespacing by menu.__name__
         if not node.namespace:
             node.namespace = menu_class_name
-        if node.namespace not in done_nodes:
-            # We need to create the namespace dict to avoid KeyErrors
-            done_nodes[node.namespace] = {} 
-        
-        # If we have seen the parent_id already...
-        if node.parent_id in done_nodes[node.namespace] :
-            # Implicit parent namespace by menu.__name__
-            if not node.parent_namespace:
-                node.parent_namespace = menu_class_name
-            parent = done_nodes[node.namespace][node.parent_id]
-            parent.children.append(node)
-            node.parent = parent
-        # If it has a parent_id but we haven't seen it yet...
-        elif node.parent_id:
-            # We check for infinite loops here, by comparing the number of 
-            # times we "saw" this node to the number of nodes in the list
-            if node._counter < list_total_length:
-                nodes.append(node)
-            # Never add this node to the final list until it has a real 
-            # parent (node.parent)
-            should_add_to_final_list = False
-            
-        if should_add_to_final_list:
+        indexes.setdefault((node.namespace, node.id), index)
+
+    rounds = [0] * len(nodes)
+    children = {}
+    pending = []
+    for index, node in enumerate(nodes):
+        parent_index = indexes.get((node.namespace, node.parent_id)) if node.parent_id else None
+        if parent_index is None:
+            if not node.parent_id:
+                rounds[index] = 1
+                pending.append(index)
+            # else: the parent does not exist, drop the node
+        else:
+            children.setdefault(parent_index, []).append(index)
+
+    # give all nodes reachable from the root nodes their round
+    while pending:
+        parent_index = pending.pop()
+        for index in children.get(parent_index, ()):
+            rounds[index] = rounds[parent_index] + (1 if index < parent_index else 0)
+            pending.append(index)
+
+    # sort the accepted nodes by round and position without comparing them
+    by_round = []
+    for index, node_round in enumerate(rounds):
+        if node_round:
+            while len(by_round) < node_round:
+                by_round.append([])
+            by_round[node_round - 1].append(index)
+
+    final_nodes = []
+    for indexes_in_round in by_round:
+        for index in indexes_in_round:
+            node = nodes[index]
+            if node.parent_id:
+                # Implicit parent namespace by menu.__name__
+                if not node.parent_namespace:
+                    node.parent_namespace = menu_class_name
+                parent = nodes[indexes[(node.namespace, node.parent_id)]]
+                parent.children.append(node)
+                node.parent = parent
             final_nodes.append(node)
-            # add it to the "seen" list
-            done_nodes[node.namespace][node.id] = node
     return final_nodes
 
+
+# the attributes of a node besides its parent and children, in the order they
+# are stored in the cache
+_NODE_FIELDS = ('title', 'url', 'id', 'parent_id', 'parent_namespace', 'namespace', 'visible', 'attr')
+
+
+def _get_node_state(node):
+    """
+    Returns the values of the fields of a node and a dictionary with its other
+    attributes, without its parent and children.
+    """
+    values = tuple(getattr(node, name, None) for name in _NODE_FIELDS)
+    return values, getattr(node, 'extra', None) or {}
+
+
+def _set_node_state(node, values, extra):
+    """
+    Sets the fields of a node and a copy of its other attributes.
+    """
+    for name, value in zip(_NODE_FIELDS, values):
+        setattr(node, name, value)
+    if extra:
+        node.extra = dict(extra)
+
+
+def _dump_nodes(nodes):
+    """
+    Returns the nodes of a menu in the format they are cached in: a tuple of
+    the class, the index of the parent in the list (or -1), the values of the
+    fields and the other attributes of every node. Pickling the nodes
+    themselves would pickle them through their parents and children, nested
+    as deep as the tree.
+    """
+    indexes = dict((id(node), index) for index, node in enumerate(nodes))
+    dumped = []
+    for node in nodes:
+        parent = getattr(node, 'parent', None)
+        parent_index = indexes.get(id(parent), -1) if parent is not None else -1
+        dumped.append((node.__class__, parent_index) + _get_node_state(node))
+    return dumped
+
+
+def _load_nodes(dumped):
+    """
+    Rebuilds the nodes returned by _dump_nodes, with their parents and
+    children.
+    """
+    nodes = []
+    for cls, parent_index, values, extra in dumped:
+        node = cls.__new__(cls)
+        _set_node_state(node, values, extra)
+        node.children = []
+        node.parent = None
+        nodes.append(node)
+    for node, (cls, parent_index, values, extra) in zip(nodes, dumped):
+        if parent_index >= 0:
+            node.parent = nodes[parent_index]
+            node.parent.children.append(node)
+    return nodes
+
+
+def _get_node_views(nodes):
+    """
+    Returns copies of the nodes for modifiers to change, with children and
+    parents pointing to the copies. Only the nodes and their attr dictionary
+    are copied, their title, url and other values are shared with the
+    original nodes, which are never changed.
+    """
+    views = {}
+    for node in nodes:
+        view = node.__class__.__new__(node.__class__)
+        _set_node_state(view, *_get_node_state(node))
+        if view.attr is not None:
+            view.attr = dict(view.attr)
+        view.children = node.children
+        view.parent = node.parent
+        views[id(node)] = view
+    for view in views.values():
+        view.children = [views.get(id(child), child) for child in view.children]
+        if view.parent is not None:
+            view.parent = views.get(id(view.parent), view.parent)
+    return [views[id(node)] for node in nodes]
+
+
+def _get_url_index(nodes):
+    """
+    Returns the lengths of the urls of the nodes, longest first, and a
+    dictionary mapping the urls to the index of the first node with the url.
+    """
+    urls = {}
+    for index, node in enumerate(nodes):
+        urls.setdefault(node.get_absolute_url(), index)
+    lengths = sorted(set(len(url) for url in urls), reverse=True)
+    return lengths, urls
+
+
+def _find_selected_index(path, url_index):
+    """
+    Returns the index of the node with the longest url the path starts with,
+    the first one if several nodes have that url, or None.
+    """
+    lengths, urls = url_index
+    for length in lengths:
+        if length > len(path):
+            continue
+        index = urls.get(path[:length])
+        if index is not None:
+            return index
+    return None
+
+
+def _get_cache_prefix():
+    return getattr(settings, "CMS_CACHE_PREFIX", "menu_cache_")
+
+
+def _get_version_key(site_id=None, language=None):
+    """
+    Returns the key of the menu cache version of a site and/or a language or,
+    if neither is given, the key of the global menu cache version.
+    """
+    return "%smenu_version_%s_%s" % (_get_cache_prefix(), site_id or '', language or '')
+
+
+def get_menu_cache_version(site_id, language):
+    """
+    Returns the version of the cached menus of a site in a language, built
+    from the global version, the version of the site, the version of the
+    language and the version of the site in the language. Incrementing any
+    of them invalidates the menus.
+
+    Versions start at a random value, so an evicted version key can never
+    bring back menus that have been invalidated before.
+    """
+    keys = [_get_version_key(), _get_version_key(site_id), _get_version_key(language=language),
+            _get_version_key(site_id, language)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = random.randint(1, 2 ** 31)
+            # another process might have been faster, use its version if so
+            if not cache.add(key, version, get_cms_setting('CACHE_DURATIONS')['menus']):
+                version = cache.get(key, version)
+            versions[key] = version
+    return '.'.join(str(versions[key]) for key in keys)
+
+
 class MenuPool(object):
     def __init__(self):
         self.menus = {}
@@ -79,16 +240,18 @@ class MenuPool(object):
         
     def clear(self, site_id=None, language=None, all=False):
         '''
-        This invalidates the cache for a given menu (site_id and language)
+        This invalidates the cache for a given menu (site_id and language).
+        If neither is given, or all is True, all menus are invalidated.
         '''
         if all:
-            cache_keys = CacheKey.objects.get_keys()
-        else:
-            cache_keys = CacheKey.objects.get_keys(site_id, language)        
-        to_be_deleted = cache_keys.distinct().values_list('key', flat=True)
-        cache.delete_many(to_be_deleted)
-        cache_keys.delete()
-    
+            site_id = language = None
+        try:
+            cache.incr(_get_version_key(site_id, language))
+        except ValueError:
+            # the version does not exist (anymore), a new one will be created
+            # when the menu is built
+            pass
+
     def register_menu(self, menu):
         from menus.base import Menu
         assert issubclass(menu, Menu)
@@ -121,32 +284,45 @@ class MenuPool(object):
                 the node is put at the bottom of the list
         """
         # Cache key management
+        # the nodes of each menu are cached on their own, so menus can decide
+        # what their nodes depend on (see Menu.get_cache_vary)
         lang = get_language()
-        prefix = getattr(settings, "CMS_CACHE_PREFIX", "menu_cache_")
-        key = "%smenu_nodes_%s_%s" % (prefix, lang, site_id)
-        if request.user.is_authenticated():
-            key += "_%s_user" % request.user.pk
-        cached_nodes = cache.get(key, None)
-        if cached_nodes:
-            return cached_nodes
-        
+        version = get_menu_cache_version(site_id, lang)
+        # the nodes are kept on the request too, so they are only loaded once
+        # for all menus rendered for a request
+        request_key = (site_id, lang, version, getattr(request.user, 'pk', None))
+        request_nodes = getattr(request, '_menu_nodes_cache', None)
+        if request_nodes is None:
+            request_nodes = request._menu_nodes_cache = {}
+        if request_key in request_nodes:
+            return request_nodes[request_key]
+        keys = {}
+        for menu_class_name, vary in self._get_cache_varies(request).items():
+            keys[menu_class_name] = "%smenu_nodes_%s_%s_%s_%s_%s" % (
+                _get_cache_prefix(), lang, site_id, version, menu_class_name, vary)
+        cached_nodes = cache.get_many(list(keys.values()))
+
         final_nodes = []
+        new_nodes = {}
         for menu_class_name in self.menus:
+            key = keys[menu_class_name]
+            if key in cached_nodes:
+                final_nodes += _load_nodes(cached_nodes[key])
+                continue
             nodes = self.menus[menu_class_name].get_nodes(request)
             # nodes is a list of navigation nodes (page tree in cms + others)
-            final_nodes += _build_nodes_inner_for_one_menu(nodes, menu_class_name)
-        cache.set(key, final_nodes, get_cms_setting('CACHE_DURATIONS')['menus'])
-        # We need to have a list of the cache keys for languages and sites that
-        # span several processes - so we follow the Django way and share through 
-        # the database. It's still cheaper than recomputing every time!
-        # This way we can selectively invalidate per-site and per-language, 
-        # since the cache shared but the keys aren't 
-        CacheKey.objects.get_or_create(key=key, language=lang, site=site_id)
+            nodes = _build_nodes_inner_for_one_menu(nodes, menu_class_name)
+            new_nodes[key] = _dump_nodes(nodes)
+            final_nodes += nodes
+        if new_nodes:
+            cache.set_many(new_nodes, get_cms_setting('CACHE_DURATIONS')['menus'])
+        request_nodes[request_key] = final_nodes
         return final_nodes
 
-    def apply_modifiers(self, nodes, request, namespace=None, root_id=None, post_cut=False, breadcrumb=False):
+    def apply_modifiers(self, nodes, request, namespace=None, root_id=None, post_cut=False, breadcrumb=False,
+                        url_index=None):
         if not post_cut:
-            nodes = self._mark_selected(request, nodes)
+            nodes = self._mark_selected(request, nodes, url_index)
         for cls in self.modifiers:
             inst = cls()
             nodes = inst.modify(request, nodes, namespace, root_id, post_cut, breadcrumb)
@@ -157,29 +333,95 @@ class MenuPool(object):
         if not site_id:
             site_id = Site.objects.get_current().pk
         nodes = self._build_nodes(request, site_id)
-        nodes = copy.deepcopy(nodes)
-        nodes = self.apply_modifiers(nodes, request, namespace, root_id, post_cut=False, breadcrumb=breadcrumb)
+        url_index = self._get_url_index(request, nodes)
+        nodes = self.apply_modifiers(_get_node_views(nodes), request, namespace, root_id, post_cut=False,
+                                     breadcrumb=breadcrumb, url_index=url_index)
         return nodes 
 
-    def _mark_selected(self, request, nodes):
-        sel = None
-        for node in nodes:
-            node.sibling = False
-            node.ancestor = False
-            node.descendant = False
-            node.selected = False
-            if node.get_absolute_url() == request.path[:len(node.get_absolute_url())]:
-                if sel:
-                    if len(node.get_absolute_url()) > len(sel.get_absolute_url()):
-                        sel = node
-                else:
-                    sel = node
-            else:
+    def _get_url_index(self, request, nodes):
+        """
+        Returns the url index of nodes returned by _build_nodes, which is
+        built once per request like the nodes.
+        """
+        url_indexes = getattr(request, '_menu_url_index_cache', None)
+        if url_indexes is None:
+            url_indexes = request._menu_url_index_cache = {}
+        if id(nodes) not in url_indexes:
+            # keep the nodes, so their id can't be reused
+            url_indexes[id(nodes)] = (nodes, _get_url_index(nodes))
+        return url_indexes[id(nodes)][1]
+
+    def _mark_selected(self, request, nodes, url_index=None):
+        """
+        Selects the node with the longest url the path of the request starts
+        with. Given the url index of nodes that have not been marked before,
+        this only takes as many lookups as there are url lengths.
+        """
+        if url_index is None:
+            for node in nodes:
+                node.sibling = False
+                node.ancestor = False
+                node.descendant = False
                 node.selected = False
-        if sel:
-            sel.selected = True
+            url_index = _get_url_index(nodes)
+        index = _find_selected_index(request.path, url_index)
+        if index is not None:
+            nodes[index].selected = True
         return nodes
 
+    def _get_cache_varies(self, request):
+        """
+        Returns the hashes of the values returned by the get_cache_vary
+        methods of the menus, by menu class name. They are computed once per
+        request.
+        """
+        varies = getattr(request, '_menu_vary_cache', None)
+        if varies is None:
+            varies = request._menu_vary_cache = {}
+        for menu_class_name, menu in self.menus.items():
+            if menu_class_name not in varies:
+                varies[menu_class_name] = hashlib.md5(
+                    force_unicode(menu.get_cache_vary(request)).encode('utf-8')).hexdigest()
+        return dict((menu_class_name, varies[menu_class_name]) for menu_class_name in self.menus)
+
+    def get_selected_node(self, request, site_id=None):
+        """
+        Returns the node selected for the request, without applying the
+        modifiers, or None.
+        """
+        self.discover_menus()
+        if not site_id:
+            site_id = Site.objects.get_current().pk
+        nodes = self._build_nodes(request, site_id)
+        index = _find_selected_index(request.path, self._get_url_index(request, nodes))
+        if index is None:
+            return None
+        return nodes[index]
+
+    def get_output_cache_key(self, request, name, arguments, site_id=None):
+        """
+        Returns the cache key for the output of the menu tag called name with
+        the given arguments. The output is expected to depend only on the
+        site, the language, the nodes of the menus (hence on their
+        get_cache_vary values) and the selected node, so the key changes with
+        these and whenever the menus are invalidated.
+        """
+        if not site_id:
+            site_id = Site.objects.get_current().pk
+        lang = get_language()
+        selected = self.get_selected_node(request, site_id)
+        if selected is None:
+            selected_key = None
+        else:
+            # modifiers may treat a selected node differently if it is the
+            # requested page itself
+            selected_key = (selected.namespace, selected.id, selected.get_absolute_url() == request.path)
+        value = force_unicode((name, sorted(arguments.items()), selected_key,
+                               sorted(self._get_cache_varies(request).items())))
+        return "%smenu_output_%s_%s_%s_%s" % (
+            _get_cache_prefix(), lang, site_id, get_menu_cache_version(site_id, lang),
+            hashlib.md5(value.encode('utf-8')).hexdigest())
+
     def get_menus_by_attribute(self, name, value):
         self.discover_menus()
         found = []
@@ -4,15 +4,20 @@ from __future__ import with_statement
 from classytags.arguments import IntegerArgument, Argument, StringArgument
 from classytags.core import Options
 from classytags.helpers import InclusionTag
+from cms.utils import get_cms_setting
 from cms.utils.i18n import force_language, get_language_objects
 from cms.utils.compat.dj import force_unicode
 from cms.utils.compat.urls import unquote
+from cms.utils.placeholder import restore_sekizai
 from django import template
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.utils.safestring import mark_safe
 from django.utils.translation import get_language, ugettext
 from menus.menu_pool import menu_pool
 from menus.utils import DefaultLanguageChanger
+from sekizai.helpers import Watcher
 
 
 register = template.Library()
@@ -92,7 +97,41 @@ def flatten(nodes):
     return flat
 
 
-class ShowMenu(InclusionTag):
+class CachedMenuMixin(object):
+    """
+    Caches the output of a menu tag, together with the data its template
+    added to sekizai blocks, if CMS_MENU_OUTPUT_CACHE is enabled. The output
+    is cached per site, language, selected node, arguments of the tag and
+    the values the menus vary their nodes by (see Menu.get_cache_vary), and
+    invalidated with the menus.
+    """
+    def get_output_cache_key(self, request, kwargs):
+        if not get_cms_setting('MENU_OUTPUT_CACHE') or request is None:
+            return None
+        toolbar = getattr(request, 'toolbar', None)
+        if getattr(toolbar, 'edit_mode', False) or getattr(toolbar, 'build_mode', False):
+            return None
+        if kwargs.get('next_page', None):
+            # rendering the children of a node inside a menu template
+            return None
+        return menu_pool.get_output_cache_key(request, self.name, kwargs)
+
+    def render_tag(self, context, **kwargs):
+        cache_key = self.get_output_cache_key(context.get('request', None), kwargs)
+        if cache_key is None:
+            return super(CachedMenuMixin, self).render_tag(context, **kwargs)
+        cached_value = cache.get(cache_key)
+        if cached_value is not None:
+            restore_sekizai(context, cached_value['sekizai'])
+            return mark_safe(cached_value['content'])
+        watcher = Watcher(context)
+        content = super(CachedMenuMixin, self).render_tag(context, **kwargs)
+        cache.set(cache_key, {'content': force_unicode(content), 'sekizai': watcher.get_changes()},
+                  get_cms_setting('CACHE_DURATIONS')['menus'])
+        return content
+
+
+class ShowMenu(CachedMenuMixin, InclusionTag):
     """
     render a nested list of all children of the pages
     - from_level: starting level
@@ -178,7 +217,7 @@ class ShowMenuBelowId(ShowMenu):
 register.tag(ShowMenuBelowId)
 
 
-class ShowSubMenu(InclusionTag):
+class ShowSubMenu(CachedMenuMixin, InclusionTag):
     """
     show the sub menu of the current nav-node.
     - levels: how many levels deep
@@ -250,7 +289,7 @@ class ShowSubMenu(InclusionTag):
 register.tag(ShowSubMenu)
 
 
-class ShowBreadcrumb(InclusionTag):
+class ShowBreadcrumb(CachedMenuMixin, InclusionTag):
     """
     Shows the breadcrumb from the node that has the same url as the current request
     